@@ -0,0 +1,109 @@
+"""Micro-benchmark: compiled intent engine vs the previous regex + substring routing.
+
+Usage: python benchmarks/bench_intents.py [--rounds N] [--json]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "src"))
+for key, value in {"LLM_TEMPERATURE": "0.7", "GENERAL_CHANNEL_ID": "0", "HISTO_MAX": "20"}.items():
+    os.environ.setdefault(key, value)
+
+from lycoris.intents import classify, PURGE, COUNT, CREATE, GOODBYE, TAGS  # noqa: E402
+from lycoris.config import CREATE_VERBS, PRIVATE_WORDS, PLACE_WORDS  # noqa: E402
+
+# --- Routing as it was in lycoris.logic.general / instance_chat before the intent engine
+LEGACY_CREATE_RE = re.compile(r"""(?xi)
+\b(
+  (parl(ons|er)\s+en\s+priv[ée]?)|
+  (en\s*priv[ée]\b)|
+  ((salon|canal|channel|discussion|conversation)s?\s+(priv[ée]s?))|
+  ((ouvre(r)?|cr(é|e)er?|open|create)\s+(moi\s+)?(un|une)?\s*(salon|canal|channel|discussion|conversation)?\s*(priv[ée]s?)?)|
+  \bmp\b|\bdm\b
+)\b
+""")
+LEGACY_COUNT_RE = re.compile(r"\b(combien|nombre|compte|count|how\s+many)\b.*\binstances?\b", re.I)
+LEGACY_PURGE_RE = re.compile(r"\b(purge|vider|effacer|clear|wipe)\b", re.I)
+LEGACY_GOODBYE_RE = re.compile(r"\b(au\s*revoir|aurevoir|bye|à\s*plus|ciao)\b", re.I)
+
+def legacy_want_instance(text: str) -> bool:
+    text = text.lower()
+    if LEGACY_CREATE_RE.search(text):
+        return True
+    if any(word in text for word in PRIVATE_WORDS) and any(place in text for place in PLACE_WORDS):
+        return True
+    if any(verb in text for verb in CREATE_VERBS) and any(word in text for word in PRIVATE_WORDS):
+        return True
+    return False
+
+def legacy_classify(text: str) -> frozenset:
+    norm = text.lower()
+    intents = set()
+    if LEGACY_PURGE_RE.search(norm):
+        intents.add(PURGE)
+    if LEGACY_COUNT_RE.search(norm) or (re.search(r"\binstances?\b", norm) and re.search(r"\b(combien|nombre|compte)\b", norm)):
+        intents.add(COUNT)
+    if legacy_want_instance(norm):
+        intents.add(CREATE)
+    if LEGACY_GOODBYE_RE.search(text):
+        intents.add(GOODBYE)
+    if re.search(r"tags?\s*:\s*(.+)$", text, re.I):
+        intents.add(TAGS)
+    return frozenset(intents)
+
+def engine_classify(text: str) -> frozenset:
+    return classify(text).intents
+
+def load_corpus():
+    with open(HERE / "intent_corpus.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def evaluate(fn, corpus):
+    errors = []
+    for row in corpus:
+        got = fn(row["text"])
+        if got != frozenset(row["intents"]):
+            errors.append({"text": row["text"], "expected": sorted(row["intents"]), "got": sorted(got)})
+    return errors
+
+def timeit(fn, corpus, rounds: int) -> float:
+    texts = [row["text"] for row in corpus]
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            fn(text)
+    return (time.perf_counter() - begin) / (rounds * len(texts)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="machine-readable output")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    results = {}
+    for name, fn in (("legacy", legacy_classify), ("engine", engine_classify)):
+        errors = evaluate(fn, corpus)
+        results[name] = {
+            "us_per_message": round(timeit(fn, corpus, args.rounds), 3),
+            "accuracy": round(1 - len(errors) / len(corpus), 4),
+            "errors": errors,
+        }
+
+    if args.json:
+        print(json.dumps({"corpus": len(corpus), "rounds": args.rounds, "results": results}, ensure_ascii=False, indent=2))
+        return
+    print(f"corpus: {len(corpus)} messages, {args.rounds} rounds")
+    for name, result in results.items():
+        print(f"{name:>7}: {result['us_per_message']:8.2f} µs/message  accuracy {result['accuracy']:.1%}")
+        for error in result["errors"]:
+            print(f"         ✗ {error['text']!r}: expected {error['expected']}, got {error['got']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""Offline load test: drives the message router (GeneralLogic and InstanceChatLogic) with synthetic traffic
+through fake Discord channels, against a local fake Ollama server.
+
+Usage: python benchmarks/bench_load.py [--scenario instances|general|rehydrate|all] [--json]
+
+Scenarios:
+  instances  N instance owners talking at once, each waiting for a reply before the next message
+  general    a burst of mentions in the general channel (some prompts repeated)
+  rehydrate  startup scan of M instance channels whose owners aren't in the member cache
+             (msgs_per_s is channels per second, there are no per-message latencies)
+  create     users opening instances one after another, served from the spare channel pool
+             (--pool 0 to compare with plain channel creation)
+
+--large-slowdown F serves instances from a second model F times slower than the general one, to
+watch the tier router (replies per tier are reported with --json).
+
+Lycoris settings still come from the environment, e.g. LLM_STREAM=1 to bench streamed replies.
+With --scenario all, every scenario runs in its own process, so peak RSS (a per-process high
+water mark) and the module-level state are each scenario's own.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import subprocess
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "src"))
+sys.path.insert(0, str(HERE))
+for key, value in {
+    "LLM_TEMPERATURE": "0.7", "GENERAL_CHANNEL_ID": "1", "HISTO_MAX": "20", "OLLAMA_MODEL": "bench",
+    "INSTANCE_CATEGORY_NAME": "Lycoris", "STATE_DB": "", "METRICS_PORT": "0", "TOPIC_REPAIR_DELAY": "0",
+}.items():
+    os.environ.setdefault(key, value)
+
+from fakes import FakeBot, FakeChannel, FakeGuild, FakeMessage, FakeOllama, FakeUser  # noqa: E402
+from lycoris.config import GENERAL_CHANNEL_ID, INSTANCE_CATEGORY_NAME, LLM_KV_CONTEXT  # noqa: E402
+from lycoris.kvcontext import sessions  # noqa: E402
+from lycoris.llm import OllamaClient, TierRouter  # noqa: E402
+from lycoris.state import registry  # noqa: E402
+from lycoris.instances import create_instance, rehydrate_guild  # noqa: E402
+from lycoris.pool import pool  # noqa: E402
+from lycoris.logic.general import GeneralLogic  # noqa: E402
+from lycoris.logic.instance_chat import InstanceChatLogic  # noqa: E402
+from lycoris.logic.router import Router  # noqa: E402
+
+PROMPTS = [
+    "Salut, tu peux m'expliquer la photosynthèse ?",
+    "Donne-moi une idée de recette rapide",
+    "What's the capital of Australia?",
+    "Résume-moi la révolution française en deux phrases",
+    "C'est quoi un trou noir ?",
+    "Tu connais un bon livre de science-fiction ?",
+]
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def summarize(name: str, latencies: List[float], elapsed: float, extra: Dict) -> Dict:
+    result = {
+        "scenario": name,
+        "messages": len(latencies),
+        "elapsed_s": round(elapsed, 4),
+        "msgs_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if tracemalloc.is_tracing():
+        result["peak_alloc_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+    result.update(extra)
+    return result
+
+async def wait_idle(cog: InstanceChatLogic, channel_id: int):
+    """The scheduler forgets a channel once its last turn is handed over, then the outbound queue drains"""
+    await asyncio.sleep(0)
+    while cog.scheduler.busy(channel_id):
+        await asyncio.sleep(0.001)
+    await cog.bot.delivery.flush(channel_id)
+
+async def scenario_instances(llm: OllamaClient, args) -> Dict:
+    guild = FakeGuild()
+    bot = FakeBot(llm, FakeUser(name="Lycoris", bot=True), args.send_interval)
+    cog = InstanceChatLogic(bot)
+    cog.scheduler.coalesce_delay = args.coalesce
+    router = Router(bot, GeneralLogic(bot), cog)
+    category = guild.add_category(INSTANCE_CATEGORY_NAME)
+
+    owners = []
+    for index in range(args.instances):
+        user = FakeUser(name=f"user{index}")
+        guild.add_member(user)
+        channel = FakeChannel(guild, f"lycoris-user{index}", category, latency=args.discord_latency)
+        registry.create(channel.id, guild.id, user.id)
+        owners.append((user, channel))
+
+    latencies: List[float] = []
+
+    async def talk(user: FakeUser, channel: FakeChannel):
+        for turn in range(args.turns):
+            message = FakeMessage(channel, user, random.choice(PROMPTS))
+            begin = time.perf_counter()
+            await router.on_message(message)
+            await wait_idle(cog, channel.id)
+            latencies.append(time.perf_counter() - begin)
+
+    began = time.perf_counter()
+    await asyncio.gather(*(talk(user, channel) for user, channel in owners))
+    elapsed = time.perf_counter() - began
+    for _, channel in owners:
+        registry.remove(channel.id)
+    return summarize("instances", latencies, elapsed, {
+        "instances": args.instances, "turns": args.turns,
+        "kv_context": LLM_KV_CONTEXT, "kv_saved_s": round(sessions.saved, 3),
+    })
+
+# The large tier's model when --large-slowdown is set
+LARGE_MODEL = "bench-large"
+
+async def scenario_general(llm: OllamaClient, args) -> Dict:
+    guild = FakeGuild()
+    bot = FakeBot(llm, guild.me, args.send_interval)
+    cog = GeneralLogic(bot)
+    router = Router(bot, cog, InstanceChatLogic(bot))
+    channel = FakeChannel(guild, "general", latency=args.discord_latency)
+    channel.id = GENERAL_CHANNEL_ID
+    prompts = [f"{PROMPTS[key % len(PROMPTS)]} #{key}" for key in (index % args.distinct for index in range(args.burst))]
+
+    latencies: List[float] = []
+
+    async def mention(prompt: str):
+        user = FakeUser()
+        message = FakeMessage(channel, user, f"{guild.me.mention} {prompt}", mentions=[guild.me])
+        begin = time.perf_counter()
+        await router.on_message(message)
+        await bot.delivery.flush(channel.id)
+        latencies.append(time.perf_counter() - begin)
+
+    began = time.perf_counter()
+    await asyncio.gather(*(mention(prompt) for prompt in prompts))
+    elapsed = time.perf_counter() - began
+    return summarize("general", latencies, elapsed, {
+        "burst": args.burst, "distinct_prompts": args.distinct,
+        "cache_hits": cog.cache.hits, "cache_misses": cog.cache.misses,
+    })
+
+async def scenario_rehydrate(llm: OllamaClient, args) -> Dict:
+    guild = FakeGuild(gateway_latency=args.gateway_latency)
+    category = guild.add_category(INSTANCE_CATEGORY_NAME)
+    for index in range(args.channels):
+        # Owners are known to the gateway but not cached, as right after a restart
+        user = FakeUser(name=f"user{index}")
+        guild.add_member(user, cached=False)
+        FakeChannel(guild, f"lycoris-user{index}", category, topic=f"lyc-owner:{user.id}", latency=args.discord_latency)
+
+    began = time.perf_counter()
+    restored = await rehydrate_guild(guild, guild.me)
+    elapsed = time.perf_counter() - began
+    for channel_id in registry.guild_channels(guild.id):
+        registry.remove(channel_id)
+    result = summarize("rehydrate", [], elapsed, {"channels": args.channels, "restored": restored})
+    result["msgs_per_s"] = round(restored / elapsed, 2) if elapsed else 0.0   # channels per second here
+    return result
+
+async def scenario_create(llm: OllamaClient, args) -> Dict:
+    guild = FakeGuild(rest_latency=args.discord_latency, create_latency=args.create_latency)
+    guild.add_category(INSTANCE_CATEGORY_NAME)
+    pool.size, pool.refill_delay = args.pool, 0.0
+    pool.refill(guild)
+    while pool.available(guild.id) < args.pool:
+        await asyncio.sleep(0.001)
+
+    latencies: List[float] = []
+    began = time.perf_counter()
+    for index in range(args.creates):
+        user = FakeUser(name=f"user{index}")
+        guild.add_member(user)
+        begin = time.perf_counter()
+        await create_instance(guild, user)
+        latencies.append(time.perf_counter() - begin)
+        await asyncio.sleep(args.create_gap)
+    elapsed = time.perf_counter() - began
+    await pool.close()
+    for channel_id in registry.guild_channels(guild.id):
+        registry.remove(channel_id)
+    return summarize("create", latencies, elapsed, {
+        "creates": args.creates, "pool": args.pool, "claimed": pool.claimed, "missed": pool.missed,
+    })
+
+SCENARIOS = {"instances": scenario_instances, "general": scenario_general, "rehydrate": scenario_rehydrate,
+             "create": scenario_create}
+
+async def run(args) -> List[Dict]:
+    """One scenario (see main() for --scenario all)"""
+    slower = {LARGE_MODEL: args.large_slowdown} if args.large_slowdown else None
+    ollama = await FakeOllama(latency=args.llm_latency, token_rate=args.token_rate, tokens=args.tokens,
+                              prompt_rate=args.prompt_rate, slower=slower).start()
+    tiers = TierRouter(fast=ollama.model, large=LARGE_MODEL) if slower else TierRouter(ollama.model, ollama.model)
+    llm = OllamaClient(ollama.url, max_inflight=args.inflight, tiers=tiers)
+    await llm.open()
+    results = []
+    try:
+        if args.trace_memory:
+            tracemalloc.start()
+        result = await SCENARIOS[args.scenario](llm, args)
+        if args.trace_memory:
+            tracemalloc.stop()
+        result["ollama_requests"] = ollama.requests
+        result["ollama_peak_concurrency"] = ollama.peak_active
+        result["tier_replies"] = dict(llm.tiers.replies)
+        results.append(result)
+    finally:
+        await pool.close()
+        await llm.close()
+        await ollama.close()
+    return results
+
+def run_isolated(name: str) -> Dict:
+    """One scenario in a fresh interpreter with the same options (--scenario and --json replaced)"""
+    argv, skip = [], False
+    for arg in sys.argv[1:]:
+        if skip:
+            skip = False
+        elif arg == "--scenario":
+            skip = True
+        elif not arg.startswith("--scenario=") and arg != "--json":
+            argv.append(arg)
+    output = subprocess.run([sys.executable, __file__, *argv, "--scenario", name, "--json"],
+                            check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output)["results"][0]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=["all", *SCENARIOS], default="all")
+    parser.add_argument("--instances", type=int, default=50, help="concurrent instance owners")
+    parser.add_argument("--turns", type=int, default=4, help="messages per instance owner")
+    parser.add_argument("--burst", type=int, default=200, help="mentions in the general burst")
+    parser.add_argument("--distinct", type=int, default=20, help="distinct prompts in the general burst")
+    parser.add_argument("--channels", type=int, default=500, help="instance channels to rehydrate")
+    parser.add_argument("--creates", type=int, default=50, help="instances opened in the create scenario")
+    parser.add_argument("--create-gap", type=float, default=0.1, help="pause between two instance openings (s)")
+    parser.add_argument("--create-latency", type=float, default=0.3, help="fake channel creation round trip (s)")
+    parser.add_argument("--pool", type=int, default=2, help="spare channels per guild (INSTANCE_POOL_SIZE)")
+    parser.add_argument("--inflight", type=int, default=4, help="LLM_MAX_INFLIGHT for the client")
+    parser.add_argument("--coalesce", type=float, default=0.0, help="instance burst window (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake prompt evaluation time (s)")
+    parser.add_argument("--prompt-rate", type=float, default=2000.0, help="fake prompt evaluation speed (tokens/s)")
+    parser.add_argument("--token-rate", type=float, default=400.0, help="fake generation speed (tokens/s)")
+    parser.add_argument("--tokens", type=int, default=40, help="tokens per fake answer")
+    parser.add_argument("--large-slowdown", type=float, default=0.0,
+                        help="instances on a second model this many times slower (0: one model for both tiers)")
+    parser.add_argument("--discord-latency", type=float, default=0.02, help="fake Discord REST round trip (s)")
+    parser.add_argument("--send-interval", type=float, default=None,
+                        help="pause between two sends in a channel (default: DELIVERY_SEND_INTERVAL)")
+    parser.add_argument("--gateway-latency", type=float, default=0.05, help="fake member query round trip (s)")
+    parser.add_argument("--trace-memory", action="store_true", help="also report tracemalloc peaks (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print one JSON document instead of a table")
+    args = parser.parse_args()
+
+    if args.scenario == "all":
+        results = [run_isolated(name) for name in SCENARIOS]
+    else:
+        random.seed(args.seed)
+        logging.basicConfig(level=logging.WARNING)
+        results = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps({"results": results}, indent=2))
+        return
+    for result in results:
+        print(f"{result['scenario']:>10}: {result['msgs_per_s']:>9} /s  p50 {str(result['p50_ms']):>8} ms  "
+              f"p99 {str(result['p99_ms']):>8} ms  peak RSS {result['peak_rss_kb'] // 1024} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Regression checks for scheduling and delivery invariants that are easy to break silently.
+
+Usage: python benchmarks/check_invariants.py   (exits 1 on the first failed check)
+"""
+import os
+import sys
+import random
+import asyncio
+from pathlib import Path
+from typing import List
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "src"))
+for key, value in {"LLM_TEMPERATURE": "0.7", "GENERAL_CHANNEL_ID": "1", "HISTO_MAX": "20", "STATE_DB": ""}.items():
+    os.environ.setdefault(key, value)
+
+from lycoris.scheduler import FairQueue  # noqa: E402
+from lycoris.utils import open_fence, split_discord  # noqa: E402
+
+def path(guild: int, user: str, weight: float = 1.0):
+    return [(("guild", guild), 1.0), (("user", user), weight)]
+
+async def grant_order(requests, capacity: int = 1) -> List[str]:
+    """Queue `requests` ((name, flows) in arrival order) behind one busy slot; names in grant order"""
+    queue = FairQueue(capacity)
+    for _ in range(capacity):
+        await queue.acquire(path(0, "holder"))
+    order: List[str] = []
+
+    async def request(name: str, flows):
+        await queue.acquire(flows)
+        order.append(name)
+        await asyncio.sleep(0)
+        queue.release()
+
+    tasks = []
+    for name, flows in requests:
+        tasks.append(asyncio.create_task(request(name, flows)))
+        await asyncio.sleep(0)
+    for _ in range(capacity):
+        queue.release()
+    await asyncio.gather(*tasks)
+    return order
+
+async def check_fair_queue():
+    # One chatty user doesn't starve another one of the same guild
+    order = await grant_order([(f"A{i}", path(1, "A")) for i in range(8)] + [("B0", path(1, "B"))])
+    assert order.index("B0") <= 1, f"user B starved inside its guild: {order}"
+
+    # A busy guild doesn't starve another guild, however many users it has
+    order = await grant_order([(f"G1u{i}", path(1, f"u{i}")) for i in range(8)] + [("G2", path(2, "x"))])
+    assert order.index("G2") <= 1, f"guild 2 starved by guild 1: {order}"
+
+    # Weights: a weight-2 user gets about twice the turns of a weight-1 sibling
+    order = await grant_order([(f"H{i}", path(1, "heavy", 2.0)) for i in range(6)]
+                              + [(f"L{i}", path(1, "light")) for i in range(6)])
+    first = order[:6]
+    assert sum(name.startswith("H") for name in first) == 4, f"weights ignored: {order}"
+
+    # A waiter that timed out neither holds a slot nor counts as waiting
+    queue = FairQueue(1)
+    await queue.acquire(path(1, "A"))
+    try:
+        await queue.acquire(path(1, "B"), timeout=0.01)
+    except asyncio.TimeoutError:
+        pass
+    assert queue.waiting == 0, queue.waiting
+    queue.release()
+    assert queue.busy == 0, queue.busy
+    await queue.acquire(path(1, "C"), timeout=0.01)
+
+def chunk_cases():
+    prose = "Une phrase de prose ordinaire, assez longue pour remplir un message. " * 500
+    code = "\n".join(f"    ligne_{i} = calcul({i})  # commentaire" for i in range(400))
+    yield "inline one-liner then prose", "```x = 1```\n" + prose
+    yield "long block", f"Voici:\n```python\n{code}\n```\nFin." + prose[:3000]
+    yield "fence-like line inside a block", f"```\n{code[:3000]}\n```python\n{code[:3000]}\n```\n" + prose[:2500]
+    yield "long info string", "```" + "x" * 3000 + "\n" + prose
+    rng = random.Random(0)
+    pieces = ["```", "```js", "```a = 1```", "`code`", "\n", "\n\n", " ", "mot", "é\u0301", "👩\u200d💻", prose[:300]]
+    for index in range(50):
+        yield f"random #{index}", "".join(rng.choice(pieces) for _ in range(rng.randint(50, 2000)))
+
+async def check_chunks():
+    for maxlen in (1990, 200):
+        for name, text in chunk_cases():
+            chunks = split_discord(text, maxlen)
+            assert all(len(chunk) <= maxlen for chunk in chunks), \
+                f"{name}: chunk over {maxlen} ({max(map(len, chunks))})"
+            assert len(chunks) <= 2 * len(text) // maxlen + 2, f"{name}: {len(chunks)} chunks for {len(text)} chars"
+            # Every chunk closes what it opens; fences left open by the text itself stay open only at the end
+            assert all(not open_fence(chunk) for chunk in chunks[:-1]), f"{name}: unbalanced fence"
+            if not open_fence(text):
+                assert not open_fence(chunks[-1]), f"{name}: last chunk leaves a fence open"
+
+CHECKS = [check_fair_queue, check_chunks]
+
+def main():
+    for check in CHECKS:
+        try:
+            asyncio.run(check())
+        except AssertionError as error:
+            print(f"FAIL {check.__name__}: {error}")
+            sys.exit(1)
+        print(f"ok   {check.__name__}")
+
+if __name__ == "__main__":
+    main()
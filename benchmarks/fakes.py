@@ -0,0 +1,337 @@
+"""Stand-ins for the load harness: a Discord layer that never touches the network and a
+local HTTP server speaking enough of the Ollama API for lycoris.llm.
+
+Channels subclass discord.TextChannel so the cogs' isinstance checks still route them.
+"""
+import json
+import time
+import asyncio
+import contextlib
+import itertools
+import discord
+from typing import Dict, List, Optional
+from lycoris.compaction import Compactor
+from lycoris.delivery import Delivery
+
+_ids = itertools.count(10_000)
+
+def next_id() -> int:
+    return next(_ids)
+
+# --- Discord
+class FakeUser:
+    def __init__(self, user_id: Optional[int] = None, name: str = "user", bot: bool = False):
+        self.id = user_id or next_id()
+        self.name = self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{self.id}>"
+
+    def __str__(self) -> str:
+        return self.name
+
+    async def send(self, content: str):
+        return FakeMessage(None, self, content)
+
+class FakeMessage:
+    def __init__(self, channel: Optional["FakeChannel"], author: FakeUser, content: str,
+                 mentions: Optional[List[FakeUser]] = None):
+        self.id = next_id()
+        self.channel = channel
+        self.guild = channel.guild if channel is not None else None
+        self.author = author
+        self.content = content
+        self.mentions = mentions or []
+        self.pinned = False
+        self.created_at = discord.utils.utcnow()
+
+    async def edit(self, content: str = None, **_):
+        await self.channel.round_trip()
+        self.content = content
+
+    async def delete(self):
+        await self.channel.round_trip()
+
+class FakeCategory:
+    def __init__(self, guild: "FakeGuild", name: str):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.text_channels: List["FakeChannel"] = []
+
+class FakeChannel(discord.TextChannel):
+    """discord.TextChannel without a gateway: sends only cost `latency` seconds"""
+
+    def __init__(self, guild: "FakeGuild", name: str, category: Optional[FakeCategory] = None,
+                 topic: Optional[str] = None, latency: float = 0.0):
+        # TextChannel.__init__ wants a gateway payload and a ConnectionState
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.topic = topic
+        self.latency = latency
+        self.sent: List[FakeMessage] = []
+        self._fake_category = category
+        self._fake_overwrites: Dict = {}
+        if category is not None:
+            category.text_channels.append(self)
+        guild.channels[self.id] = self
+
+    @property
+    def category(self):
+        return self._fake_category
+
+    @property
+    def overwrites(self):
+        return self._fake_overwrites
+
+    @property
+    def members(self):
+        return []
+
+    def permissions_for(self, obj):
+        return discord.Permissions.all()
+
+    def typing(self):
+        return contextlib.nullcontext()
+
+    async def round_trip(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send(self, content: str = None, **_):
+        await self.round_trip()
+        message = FakeMessage(self, self.guild.me, content)
+        self.sent.append(message)
+        return message
+
+    async def edit(self, name: Optional[str] = None, topic: Optional[str] = None, overwrites: Optional[Dict] = None, **_):
+        await self.round_trip()
+        if name is not None:
+            self.name = name
+        if topic is not None:
+            self.topic = topic
+        if overwrites is not None:
+            self._fake_overwrites = dict(overwrites)
+        return self
+
+    async def delete(self, **_):
+        await self.round_trip()
+        self.guild.channels.pop(self.id, None)
+        if self._fake_category is not None and self in self._fake_category.text_channels:
+            self._fake_category.text_channels.remove(self)
+
+    async def history(self, limit=None, oldest_first=False):
+        for message in list(reversed(self.sent))[:limit]:
+            yield message
+
+class FakeGuild:
+    def __init__(self, name: str = "bench", gateway_latency: float = 0.0, rest_latency: float = 0.0,
+                 create_latency: float = 0.0):
+        self.id = next_id()
+        self.name = name
+        self.me = FakeUser(name="Lycoris", bot=True)
+        self.default_role = FakeUser(name="@everyone")
+        self.gateway_latency = gateway_latency
+        self.rest_latency = rest_latency
+        self.create_latency = create_latency   # creating a channel is much slower than editing one
+        self.channels: Dict[int, FakeChannel] = {}
+        self.categories: List[FakeCategory] = []
+        self._members: Dict[int, FakeUser] = {}   # member cache
+        self._known: Dict[int, FakeUser] = {}     # members the "gateway" can return
+
+    def __str__(self) -> str:
+        return self.name
+
+    @property
+    def members(self) -> List[FakeUser]:
+        return list(self._members.values())
+
+    def add_member(self, member: FakeUser, cached: bool = True):
+        self._known[member.id] = member
+        if cached:
+            self._members[member.id] = member
+
+    def get_member(self, user_id: int) -> Optional[FakeUser]:
+        return self._members.get(user_id)
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id)
+
+    async def query_members(self, user_ids=None, limit=5, cache=True, **_):
+        await asyncio.sleep(self.gateway_latency)
+        found = [self._known[uid] for uid in user_ids or () if uid in self._known]
+        if cache:
+            self._members.update((member.id, member) for member in found)
+        return found
+
+    async def fetch_member(self, user_id: int) -> FakeUser:
+        await asyncio.sleep(self.gateway_latency)
+        if user_id not in self._known:
+            raise discord.NotFound(_Response(404), "Unknown Member")
+        return self._known[user_id]
+
+    def add_category(self, name: str) -> FakeCategory:
+        category = FakeCategory(self, name)
+        self.categories.append(category)
+        return category
+
+    async def create_category(self, name: str, **_) -> FakeCategory:
+        await asyncio.sleep(self.rest_latency)
+        return self.add_category(name)
+
+    async def create_text_channel(self, name: str, category: Optional[FakeCategory] = None,
+                                  overwrites: Optional[Dict] = None, topic: Optional[str] = None, **_) -> FakeChannel:
+        await asyncio.sleep(self.create_latency or self.rest_latency)
+        channel = FakeChannel(self, name, category, topic=topic, latency=self.rest_latency)
+        channel._fake_overwrites = dict(overwrites or {})
+        return channel
+
+class _Response:
+    def __init__(self, status: int):
+        self.status = status
+        self.reason = "fake"
+
+class FakeBot:
+    """What the cogs read from commands.Bot: the bot user, the LLM client, the outbound queues
+    and the history compactor"""
+
+    def __init__(self, llm, user: FakeUser, send_interval: Optional[float] = None):
+        self.llm = llm
+        self.delivery = Delivery() if send_interval is None else Delivery(send_interval)
+        self.compactor = Compactor(llm)
+        self.user = user
+        self.guilds: List[FakeGuild] = []
+
+# --- Ollama
+class FakeOllama:
+    """Minimal Ollama HTTP server: /api/tags, /api/chat and /api/generate, streamed or not.
+
+    Every generation waits `latency` seconds plus its prompt tokens at `prompt_rate` tokens/sec
+    (prompt evaluation; 0 for a fixed delay), then produces `tokens` tokens at `token_rate`
+    tokens/sec. /api/generate returns a `context` extending the one it was given. `slower`
+    serves more models, each taking that many times longer than `model`.
+    """
+
+    def __init__(self, model: str = "bench", latency: float = 0.05, token_rate: float = 200.0, tokens: int = 40,
+                 prompt_rate: float = 0.0, slower: Optional[Dict[str, float]] = None):
+        self.model = model
+        self.slower = slower or {}
+        self.latency = latency
+        self.prompt_rate = prompt_rate
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.requests = 0
+        self.active = 0
+        self.peak_active = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> "FakeOllama":
+        self._server = await asyncio.start_server(self._connection, host, port)
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # HTTP/1.1 keep-alive: httpx reuses pooled connections
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                method, path, _ = request.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode().partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                await self._dispatch(method, path, json.loads(body) if body else {}, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Client went away, or the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, payload: Dict, writer: asyncio.StreamWriter):
+        if path == "/api/tags":
+            names = [self.model, *self.slower]
+            return await self._json(writer, {"models": [{"name": name, "model": name} for name in names]})
+        if path not in ("/api/chat", "/api/generate") or method != "POST":
+            return await self._json(writer, {"error": "not found"}, status="404 Not Found")
+
+        self.requests += 1
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        try:
+            chat = path == "/api/chat"
+            tokens = self.tokens if payload.get("prompt", True) != "" else 0
+            factor = self.slower.get(payload.get("model"), 1.0)
+            started = time.perf_counter_ns()
+            evaluated = self._prompt_tokens(payload)
+            await asyncio.sleep((self.latency + (evaluated / self.prompt_rate if self.prompt_rate else 0.0)) * factor)
+            prompt_done = time.perf_counter_ns()
+            if not payload.get("stream", True):
+                await asyncio.sleep(tokens / self.token_rate * factor)
+                final = self._final(chat, "mot " * tokens, tokens, started, prompt_done, payload)
+                return await self._json(writer, final)
+
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n")
+            for _ in range(tokens):
+                await asyncio.sleep(factor / self.token_rate)
+                self._chunk(writer, self._delta(chat, "mot "))
+                await writer.drain()
+            self._chunk(writer, self._final(chat, "", tokens, started, prompt_done, payload))
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            self.active -= 1
+
+    def _delta(self, chat: bool, text: str) -> Dict:
+        if chat:
+            return {"model": self.model, "message": {"role": "assistant", "content": text}, "done": False}
+        return {"model": self.model, "response": text, "done": False}
+
+    def _final(self, chat: bool, text: str, tokens: int, started: int, prompt_done: int, payload: Dict) -> Dict:
+        now = time.perf_counter_ns()
+        data = self._delta(chat, text)
+        evaluated = self._prompt_tokens(payload)
+        data.update({
+            "done": True,
+            "total_duration": now - started,
+            "load_duration": 0,
+            "prompt_eval_count": evaluated,
+            "prompt_eval_duration": prompt_done - started,
+            "eval_count": tokens,
+            "eval_duration": max(now - prompt_done, 1),
+        })
+        if not chat:
+            data["context"] = list(payload.get("context") or []) + list(range(evaluated + tokens))
+        return data
+
+    @staticmethod
+    def _prompt_tokens(payload: Dict) -> int:
+        """Tokens to evaluate: the whole chat, or what /api/generate adds to its context"""
+        if "messages" in payload:
+            return len(json.dumps(payload["messages"])) // 4
+        return (len(payload.get("system") or "") + len(payload.get("prompt") or "")) // 4
+
+    @staticmethod
+    def _chunk(writer: asyncio.StreamWriter, data: Dict):
+        line = json.dumps(data).encode() + b"\n"
+        writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+
+    @staticmethod
+    async def _json(writer: asyncio.StreamWriter, data: Dict, status: str = "200 OK"):
+        body = json.dumps(data).encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
@@ -0,0 +1,79 @@
+import re
+import time
+import asyncio
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from .config import TEMPERATURE, GENERAL_CACHE_SIZE, GENERAL_CACHE_TTL
+
+def normalize_prompt(text: str) -> str:
+    """Case, apostrophe and spacing insensitive form of a prompt"""
+    text = unicodedata.normalize("NFKC", text or "").casefold().replace("’", "'")
+    text = re.sub(r"\s+([?!.,;:])", r"\1", text)
+    return " ".join(text.split())
+
+def cache_key(prompt: str, system: str, model: str) -> Tuple[str, str, float, str]:
+    return (normalize_prompt(prompt), model, TEMPERATURE, system)
+
+class ResponseCache:
+    """LRU cache of model answers with a per-entry TTL and hit/miss counters"""
+
+    def __init__(self, maxsize: int = GENERAL_CACHE_SIZE, ttl: float = GENERAL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, str]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: Hashable, value: str):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+class SingleFlight:
+    """Merge concurrent identical calls: followers await the leader's result"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[str]]) -> str:
+        call = self._calls.get(key)
+        if call is not None:
+            return await asyncio.shield(call)
+        call = asyncio.get_running_loop().create_future()
+        self._calls[key] = call
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except Exception as error:
+            call.set_exception(error)
+            # Mark the exception as retrieved when nobody else was waiting
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
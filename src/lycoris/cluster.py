@@ -0,0 +1,225 @@
+import os
+import time
+import queue
+import signal
+import asyncio
+import logging
+import resource
+import multiprocessing
+from typing import Callable, Dict, List, Optional
+from .config import CLUSTER_REPORT_INTERVAL, CLUSTER_MAX_BACKOFF
+from .state import registry
+from .resident import residents
+
+def shards_of(worker: int, workers: int, shard_count: int) -> List[int]:
+    """Shards owned by one worker (round robin, so guild load spreads evenly)"""
+    return [shard for shard in range(shard_count) if shard % workers == worker]
+
+def shard_of(guild_id: int, shard_count: int) -> int:
+    """Shard Discord routes a guild to"""
+    return (guild_id >> 22) % shard_count
+
+class WorkerSpec:
+    """What one worker process runs: its index, its shards, and where it reports"""
+
+    def __init__(self, index: int, shard_ids: List[int], shard_count: int, reports):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.reports = reports
+
+    def owns_guild(self, guild_id: int) -> bool:
+        return shard_of(guild_id, self.shard_count) in self.shard_ids
+
+def inflight_share(total: int, workers: int, index: int) -> int:
+    """Worker `index`'s part of the per-backend in-flight budget, so that all workers together
+    stay within `total` (each keeps at least one slot)"""
+    share = total // workers + (1 if index < total % workers else 0)
+    return max(share, 1)
+
+def current_rss_kb() -> Optional[int]:
+    """Resident set size right now (Linux /proc; None elsewhere). ru_maxrss is only the peak."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+async def report_loop(spec: WorkerSpec, bot, interval: float = CLUSTER_REPORT_INTERVAL):
+    """Send a health and load snapshot to the supervisor every `interval` seconds"""
+    started = time.monotonic()
+    last_time, last_count = started, 0
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        router = getattr(bot, "router", None)
+        handled = router.seen if router else 0
+        latency = bot.latency
+        report = {
+            "worker": spec.index,
+            "pid": os.getpid(),
+            "time": time.time(),
+            "shards": spec.shard_ids,
+            "ready": bot.is_ready(),
+            "guilds": len(bot.guilds),
+            "instances": len(registry),
+            "resident_kb": residents.resident_bytes // 1024,
+            "latency_ms": round(latency * 1000, 1) if latency == latency and latency != float("inf") else None,
+            "llm_inflight": bot.llm.inflight,
+            "llm_waiting": bot.llm.waiting,
+            "llm_tiers": bot.llm.tiers.stats(),
+            "msgs_per_s": round((handled - last_count) / (now - last_time), 2),
+            "dropped": router.drops_by_class() if router else {},
+            "rss_kb": current_rss_kb(),
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "uptime_s": round(now - started),
+        }
+        last_time, last_count = now, handled
+        try:
+            spec.reports.put_nowait(report)
+        except queue.Full:
+            pass
+
+class _Worker:
+    __slots__ = ("spec", "process", "started", "restarts", "backoff", "next_start", "last_report")
+
+    def __init__(self, spec: WorkerSpec):
+        self.spec = spec
+        self.process: Optional[multiprocessing.Process] = None
+        self.started = 0.0
+        self.restarts = 0
+        self.backoff = 1.0
+        self.next_start = 0.0
+        self.last_report: Optional[Dict] = None
+
+class Supervisor:
+    """Run one bot process per worker, restart the ones that die or stop reporting,
+    and log a cluster health summary from their reports."""
+
+    def __init__(self, target: Callable[[WorkerSpec], None], workers: int, shard_count: int = 0,
+                 report_interval: float = CLUSTER_REPORT_INTERVAL, max_backoff: float = CLUSTER_MAX_BACKOFF):
+        shard_count = shard_count or workers
+        if workers > shard_count:
+            raise ValueError(f"{workers} workers for {shard_count} shards: some workers would have nothing to run")
+        self.target = target
+        self.report_interval = report_interval
+        self.max_backoff = max_backoff
+        # Fresh interpreters: nothing of this process' event loop or sockets leaks into workers
+        self._mp = multiprocessing.get_context("spawn")
+        self.reports = self._mp.Queue(maxsize=1000)
+        self.workers = [
+            _Worker(WorkerSpec(index, shards_of(index, workers, shard_count), shard_count, self.reports))
+            for index in range(workers)
+        ]
+        self._stopping = False
+
+    def run(self):
+        previous = signal.signal(signal.SIGTERM, self._on_sigterm)
+        try:
+            for worker in self.workers:
+                self._start(worker)
+            last_summary = time.monotonic()
+            while not self._stopping:
+                self._collect(timeout=1.0)
+                self._check()
+                if time.monotonic() - last_summary >= self.report_interval:
+                    last_summary = time.monotonic()
+                    self._summary()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            self.stop()
+
+    def stop(self):
+        self._stopping = True
+        alive = [w.process for w in self.workers if w.process is not None and w.process.is_alive()]
+        for process in alive:
+            process.terminate()   # SIGTERM: workers close their stores cleanly
+        deadline = time.monotonic() + 15
+        for process in alive:
+            process.join(max(deadline - time.monotonic(), 0.1))
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def _on_sigterm(self, signum, frame):
+        self._stopping = True
+
+    def _start(self, worker: _Worker):
+        worker.process = self._mp.Process(target=self.target, args=(worker.spec,),
+                                          name=f"lycoris-worker-{worker.spec.index}", daemon=False)
+        worker.process.start()
+        worker.started = time.monotonic()
+        worker.last_report = None
+        logging.info(f"Lycoris::Cluster::Worker {worker.spec.index} started (pid={worker.process.pid}, "
+                     f"shards={worker.spec.shard_ids}/{worker.spec.shard_count})")
+
+    def _collect(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                report = self.reports.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return
+            worker = self.workers[report["worker"]]
+            if worker.process is not None and report["pid"] == worker.process.pid:
+                worker.last_report = report
+
+    def _check(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            process = worker.process
+            if process is None:
+                if now >= worker.next_start:
+                    self._start(worker)
+                continue
+            if process.is_alive():
+                if worker.backoff > 1 and now - worker.started > self.max_backoff:
+                    worker.backoff = 1.0   # stable again
+                if self._stale(worker, now):
+                    logging.error(f"Lycoris::Cluster::Worker {worker.spec.index} stopped reporting, restarting it")
+                    process.kill()
+                    process.join()
+                    self._schedule_restart(worker, now)
+                continue
+            process.join()
+            logging.error(f"Lycoris::Cluster::Worker {worker.spec.index} exited with code {process.exitcode}")
+            self._schedule_restart(worker, now)
+
+    def _stale(self, worker: _Worker, now: float) -> bool:
+        limit = self.report_interval * 3
+        if worker.last_report is None:
+            # Login and the first report can take a while on big shards
+            return now - worker.started > limit + 120
+        return time.time() - worker.last_report["time"] > limit
+
+    def _schedule_restart(self, worker: _Worker, now: float):
+        worker.process = None
+        worker.restarts += 1
+        worker.next_start = now + worker.backoff
+        logging.info(f"Lycoris::Cluster::Worker {worker.spec.index} restarts in {worker.backoff:.0f}s "
+                     f"(restart #{worker.restarts})")
+        worker.backoff = min(worker.backoff * 2, self.max_backoff)
+
+    def health(self) -> List[Dict]:
+        rows = []
+        for worker in self.workers:
+            row = {"worker": worker.spec.index, "alive": bool(worker.process and worker.process.is_alive()),
+                   "restarts": worker.restarts}
+            row.update(worker.last_report or {})
+            rows.append(row)
+        return rows
+
+    def _summary(self):
+        for row in self.health():
+            rss = f"{row['rss_kb'] // 1024}MiB" if row.get("rss_kb") is not None else "?"
+            if "pid" not in row:
+                logging.info(f"Lycoris::Cluster::Worker {row['worker']} alive={row['alive']} restarts={row['restarts']} (no report yet)")
+                continue
+            logging.info(
+                f"Lycoris::Cluster::Worker {row['worker']} pid={row['pid']} shards={row['shards']} ready={row['ready']} "
+                f"guilds={row['guilds']} instances={row['instances']} ({row['resident_kb'] // 1024}MiB resident) latency={row['latency_ms']}ms "
+                f"llm={row['llm_inflight']}+{row['llm_waiting']} {row['msgs_per_s']} msg/s "
+                f"rss={rss} (peak {row['peak_rss_kb'] // 1024}MiB) restarts={row['restarts']}"
+            )
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from typing import Dict, List
+from .config import SUMMARY_AT, SUMMARY_KEEP, SUMMARY_IDLE, SUMMARY_MAX_CHARS
+from .state import registry
+from .llm import EMPTY_REPLY, Preempted
+from . import metrics
+
+SUMMARY_PROMPT = (
+    "Tu résumes une conversation entre un utilisateur et Lycoris pour qu'elle s'en souvienne plus tard. "
+    "Garde les faits, préférences, décisions et questions restées ouvertes ; oublie les politesses. "
+    "Écris en français, à la troisième personne, en {limit} caractères au plus. Réponds uniquement par le résumé."
+)
+
+COMPACTIONS = metrics.Counter("lycoris_compactions_total", "Rolling summary runs per outcome", ("result",))
+
+class Compactor:
+    """Folds the older turns of idle instances into their rolling summary.
+
+    schedule() is called after each reply: once a channel's history reaches SUMMARY_AT
+    entries and it stays quiet for SUMMARY_IDLE seconds, everything but the last
+    SUMMARY_KEEP entries is summarized with a background (preemptible) LLM call, then
+    removed from the history. Any new message in the channel cancels the pending work.
+    """
+
+    def __init__(self, llm, threshold: int = SUMMARY_AT, keep: int = SUMMARY_KEEP,
+                 idle: float = SUMMARY_IDLE, max_chars: int = SUMMARY_MAX_CHARS):
+        self.llm = llm
+        self.threshold = threshold
+        self.keep = keep
+        self.idle = idle
+        self.max_chars = max_chars
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def schedule(self, channel_id: int):
+        if self.threshold <= 0:
+            return
+        record = registry.get(channel_id)
+        if record is None or len(record.history) < self.threshold:
+            return
+        self.cancel(channel_id)
+        self._tasks[channel_id] = asyncio.create_task(self._run(channel_id))
+
+    def cancel(self, channel_id: int):
+        task = self._tasks.pop(channel_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, channel_id: int):
+        try:
+            await asyncio.sleep(self.idle)
+            result = await self.compact(channel_id)
+        except Preempted:
+            # Busy moment: try again after another quiet period
+            COMPACTIONS.inc(1, "preempted")
+            if self._tasks.get(channel_id) is asyncio.current_task():
+                del self._tasks[channel_id]
+                self.schedule(channel_id)
+            return
+        except Exception as error:
+            COMPACTIONS.inc(1, "failed")
+            logging.warning(f"Lycoris::Compaction::{channel_id} failed: {error!r}")
+            result = None
+        if result is not None:
+            COMPACTIONS.inc(1, result)
+        if self._tasks.get(channel_id) is asyncio.current_task():
+            del self._tasks[channel_id]
+
+    def _oldest_turns(self, history) -> List[Dict]:
+        """Entries to fold: all but the last `keep`, ending on an answer so no question is cut from it"""
+        count = len(history) - self.keep
+        entries = list(history)[:max(count, 0)]
+        while entries and entries[-1]["role"] != "assistant":
+            entries.pop()
+        return entries
+
+    async def compact(self, channel_id: int) -> str:
+        record = registry.get(channel_id)
+        # An evicted history (lycoris.resident) isn't worth reloading just to summarize it
+        if record is None or not record.loaded:
+            return "skipped"
+        old = self._oldest_turns(record.history)
+        if not old:
+            return "skipped"
+        transcript = "\n".join(f"{'Utilisateur' if entry['role'] == 'user' else 'Lycoris'}: {entry['content']}"
+                               for entry in old)
+        if record.summary:
+            transcript = f"Résumé précédent:\n{record.summary}\n\nSuite de la conversation:\n{transcript}"
+        summary = await self.llm.background_chat([
+            {"role": "system", "content": SUMMARY_PROMPT.format(limit=self.max_chars)},
+            {"role": "user", "content": transcript},
+        ])
+        summary = summary.strip()[:self.max_chars]
+        if summary == EMPTY_REPLY:
+            raise ValueError("empty summary")
+
+        # The history may have moved on while the summary was written (a reply delivered, an eviction)
+        history = record.history
+        if (registry.get(channel_id) is not record or not record.loaded or len(history) < len(old)
+                or history[0] is not old[0] or history[len(old) - 1] is not old[-1]):
+            return "stale"
+        for _ in old:
+            history.popleft()
+        registry.set_summary(channel_id, summary)
+        logging.info(f"Lycoris::Compaction::{channel_id} {len(old)} entries folded into a "
+                     f"{len(summary)} chars summary, {len(history)} left")
+        return "ok"
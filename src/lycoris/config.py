@@ -1,5 +1,5 @@
 
-import os, re
+import os
 from dotenv import load_dotenv, find_dotenv
 import discord
 
@@ -17,13 +17,73 @@ def make_intents() -> discord.Intents:
 
 # --- OLLAMA
 OLLAMA_URL   = os.getenv("OLLAMA_URL")
+OLLAMA_URLS  = [url.strip() for url in os.getenv("OLLAMA_URLS", OLLAMA_URL or "").split(",") if url.strip()]
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
 TEMPERATURE  = float(os.getenv("LLM_TEMPERATURE"))
 
+# --- Cluster mode: CLUSTER_WORKERS processes sharing SHARD_COUNT shards (0 = one shard per worker)
+CLUSTER_WORKERS         = int(os.getenv("CLUSTER_WORKERS", "1"))
+SHARD_COUNT             = int(os.getenv("SHARD_COUNT", "0"))
+CLUSTER_REPORT_INTERVAL = float(os.getenv("CLUSTER_REPORT_INTERVAL", "30"))   # worker health reports
+CLUSTER_MAX_BACKOFF     = float(os.getenv("CLUSTER_MAX_BACKOFF", "60"))       # cap between restarts of a crashing worker
+
+# --- LLM client: connection pool and concurrency limits
+LLM_TIMEOUT          = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_INFLIGHT     = int(os.getenv("LLM_MAX_INFLIGHT", "2"))         # per backend, split across cluster workers
+LLM_QUEUE_TIMEOUT    = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_POOL_CONNECTIONS = int(os.getenv("LLM_POOL_CONNECTIONS", "8"))
+LLM_POOL_KEEPALIVE   = float(os.getenv("LLM_POOL_KEEPALIVE", "30"))
+LLM_COALESCE_DELAY   = float(os.getenv("LLM_COALESCE_DELAY", "0.8"))  # burst window merged into one instance turn
+
+# --- Several Ollama backends (OLLAMA_URLS, comma separated): model probes and circuit breakers
+LLM_PROBE_INTERVAL   = float(os.getenv("LLM_PROBE_INTERVAL", "30"))    # /api/tags refresh per backend
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))     # consecutive failures before a backend is skipped
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # seconds before it gets a trial request
+
+# --- Model tiers: general answers on the fast model, instances on the large one (both default to OLLAMA_MODEL).
+# A general prompt of LLM_TIER_LONG_PROMPT estimated tokens or more goes to the large model; the large tier
+# falls back to the fast one while LLM_TIER_QUEUE_DEPTH requests wait for a slot, or while its p95 latency
+# over the last LLM_TIER_WINDOW seconds is above LLM_TIER_P95_TARGET (0 disables each rule)
+LLM_MODEL_FAST       = os.getenv("LLM_MODEL_FAST") or OLLAMA_MODEL
+LLM_MODEL_LARGE      = os.getenv("LLM_MODEL_LARGE") or OLLAMA_MODEL
+LLM_TIER_LONG_PROMPT = int(os.getenv("LLM_TIER_LONG_PROMPT", "400"))
+LLM_TIER_QUEUE_DEPTH = int(os.getenv("LLM_TIER_QUEUE_DEPTH", "4"))
+LLM_TIER_P95_TARGET  = float(os.getenv("LLM_TIER_P95_TARGET", "15"))
+LLM_TIER_WINDOW      = float(os.getenv("LLM_TIER_WINDOW", "120"))
+
+# --- Model residency: Ollama keep_alive sent with every request, released after LLM_IDLE_RELEASE s without traffic
+LLM_KEEP_ALIVE   = os.getenv("LLM_KEEP_ALIVE", "30m")
+LLM_IDLE_RELEASE = float(os.getenv("LLM_IDLE_RELEASE", "1800"))   # 0 never releases
+LLM_WARMUP       = os.getenv("LLM_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# --- Streaming replies (progressive message edits)
+LLM_STREAM           = os.getenv("LLM_STREAM", "false").lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.2"))
+
+# --- Outbound delivery: minimum pause between two sends in one channel (backs off on 429)
+DELIVERY_SEND_INTERVAL = float(os.getenv("DELIVERY_SEND_INTERVAL", "0.25"))
+
+# --- Prometheus metrics endpoint (/metrics). 0 disables recording entirely
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# --- General channel response cache (0 disables it)
+GENERAL_CACHE_SIZE = int(os.getenv("GENERAL_CACHE_SIZE", "256"))
+GENERAL_CACHE_TTL  = float(os.getenv("GENERAL_CACHE_TTL", "600"))
+
 # --- General Channel ID and Lycoris Category Name
 GENERAL_CHANNEL_ID = int(os.getenv("GENERAL_CHANNEL_ID"))
 INSTANCE_CATEGORY_NAME = os.getenv("INSTANCE_CATEGORY_NAME")
 
+# --- Startup rehydration of instance channels
+REHYDRATE_CONCURRENCY       = int(os.getenv("REHYDRATE_CONCURRENCY", "8"))        # channels scanned at once per guild
+REHYDRATE_GUILD_CONCURRENCY = int(os.getenv("REHYDRATE_GUILD_CONCURRENCY", "4"))  # guilds scanned at once
+TOPIC_REPAIR_DELAY          = float(os.getenv("TOPIC_REPAIR_DELAY", "1.0"))       # pause between deferred topic edits
+
+# --- Spare hidden channels kept per guild so opening an instance is one edit (0 disables the pool)
+INSTANCE_POOL_SIZE = int(os.getenv("INSTANCE_POOL_SIZE", "2"))
+POOL_REFILL_DELAY  = float(os.getenv("POOL_REFILL_DELAY", "2.0"))   # pause between background creations
+
 # --- Lycoris personnality and memory limit
 DEFAULT_SYSTEM = (
     "Rôles & règles : Tu es Lycoris, un assistant francophone, utile et concis. "
@@ -32,23 +92,53 @@ DEFAULT_SYSTEM = (
     "ni dans l’historique, dis clairement que tu ne sais pas. Réponds en 1–2 phrases maximum."
 )
 HISTO_MAX = int(os.getenv("HISTO_MAX"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))  # estimated tokens per instance prompt
+# Instances on /api/generate, reusing the `context` Ollama returned for the previous turn, so only the
+# new turn is evaluated; rebuilt from the full prompt once it holds more than LLM_KV_CONTEXT_MAX tokens
+LLM_KV_CONTEXT     = os.getenv("LLM_KV_CONTEXT", "false").lower() in ("1", "true", "yes")
+LLM_KV_CONTEXT_MAX = int(os.getenv("LLM_KV_CONTEXT_MAX", str(PROMPT_TOKEN_BUDGET * 2)))
+FACTS_TOP_K         = int(os.getenv("FACTS_TOP_K", "5"))             # facts retrieved per message
+FACTS_CHAR_BUDGET   = int(os.getenv("FACTS_CHAR_BUDGET", "600"))
+
+# --- Persistent state (SQLite, WAL mode). An empty STATE_DB keeps everything in RAM
+STATE_DB             = os.getenv("STATE_DB", "lycoris.db")
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "2"))
+STATE_FLUSH_BATCH    = int(os.getenv("STATE_FLUSH_BATCH", "64"))
 
-# --- Regex to detect Create and Count event in general
-CREATE_RE = re.compile(r"""(?xi)
-\b(
+# --- Rolling summary: once an idle instance has SUMMARY_AT history entries, all but the last
+# SUMMARY_KEEP are folded into a summary by a low-priority LLM call (SUMMARY_AT=0 disables it)
+SUMMARY_AT        = int(os.getenv("SUMMARY_AT", str(HISTO_MAX * 3 // 4)))
+SUMMARY_KEEP      = int(os.getenv("SUMMARY_KEEP", "6"))
+SUMMARY_IDLE      = float(os.getenv("SUMMARY_IDLE", "120"))   # seconds without messages before compacting
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "1500"))
+
+# --- Resident set: RAM budget for instance histories and facts (0 = unbounded). The least recently
+# used ones are evicted to the state store, or to SPILL_DIR when STATE_DB is empty, and reloaded on demand
+RESIDENT_BUDGET_MB = float(os.getenv("RESIDENT_BUDGET_MB", "256"))
+SPILL_DIR          = os.getenv("SPILL_DIR", "lycoris-spill")
+
+# --- Keywords to detect Create, Count, Purge and Goodbye events (compiled together by lycoris.intents)
+CREATE_PHRASE = r"""
   (parl(ons|er)\s+en\s+priv[ée]?)|
   (en\s*priv[ée]\b)|
   ((salon|canal|channel|discussion|conversation)s?\s+(priv[ée]s?))|
   ((ouvre(r)?|cr(é|e)er?|open|create)\s+(moi\s+)?(un|une)?\s*(salon|canal|channel|discussion|conversation)?\s*(priv[ée]s?)?)|
   \bmp\b|\bdm\b
-)\b
-""")
-COUNT_RE = re.compile(r"\b(combien|nombre|compte|count|how\s+many)\b.*\binstances?\b", re.I)
+"""
+COUNT_WORDS = {"combien", "nombre", "compte", "count", "how many"}
+INSTANCE_WORDS = {"instance", "instances"}
+PURGE_WORDS = {"purge", "vider", "effacer", "clear", "wipe"}
+GOODBYE_WORDS = {"au revoir", "aurevoir", "bye", "à plus", "ciao"}
+CANCEL_WORDS = {"stop", "stoppe", "annule", "annuler", "arrête", "arrete", "cancel"}
 
 CREATE_VERBS = {"crée", "cree", "créer", "creer", "ouvre", "ouvrir", "open", "create", "fait", "faire", "peux-tu", "peux tu", "pourrais-tu"}
 PRIVATE_WORDS = {"privé", "privée", "prive", "privee", "confidentiel", "confidentielle", "secret", "discret", "dm", "mp"}
 PLACE_WORDS = {"salon", "canal", "channel", "discussion", "conversation", "espace"}
 
+# --- Channel purge: pause between single deletes of old messages, progress refresh period
+PURGE_OLD_INTERVAL      = float(os.getenv("PURGE_OLD_INTERVAL", "1.0"))
+PURGE_PROGRESS_INTERVAL = float(os.getenv("PURGE_PROGRESS_INTERVAL", "3.0"))
+
 # --- Personnality addons
 PERSONALITY_TAGS = {
     "joyeuse":  "Ton ton est joyeux, chaleureux, sans exagération.",
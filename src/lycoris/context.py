@@ -0,0 +1,125 @@
+from typing import Dict, List, Optional, Tuple
+from .config import PERSONALITY_TAGS, DEFAULT_SYSTEM, PROMPT_TOKEN_BUDGET, FACTS_TOP_K, FACTS_CHAR_BUDGET
+from .state import InstanceRecord, registry, forget_hooks, unload_hooks
+
+# Chat templates add a few tokens of framing around every message
+MESSAGE_OVERHEAD = 4
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token for French/English BPE vocabularies)"""
+    return (len(text) + 3) // 4 + MESSAGE_OVERHEAD
+
+def history_entry(role: str, content: str) -> Dict:
+    """Memory entry with its token estimate cached next to it"""
+    return {"role": role, "content": content, "tokens": estimate_tokens(content)}
+
+def entry_tokens(entry: Dict) -> int:
+    tokens = entry.get("tokens")
+    if tokens is None:
+        # Entries read back from the store don't carry the estimate yet
+        tokens = entry["tokens"] = estimate_tokens(entry["content"])
+    return tokens
+
+def facts_block(record: Optional[InstanceRecord], query: str) -> str:
+    """Facts most relevant to the incoming message (BM25), within FACTS_CHAR_BUDGET. A message
+    sharing no term with any fact ("et toi ?", "continue") gets the most recent ones instead."""
+    known = record.facts if record else None
+    if not known:
+        return ""
+    index = known.index
+    lst = index.search(query, FACTS_TOP_K, FACTS_CHAR_BUDGET) or index.recent(FACTS_TOP_K, FACTS_CHAR_BUDGET)
+    if not lst:
+        return ""
+    return "Faits pour cette instance:\n" + "\n".join(f"- {f}" for f in lst)
+
+class PromptBuild:
+    """Messages sent for one instance turn and how many tokens they are estimated to use
+    (prompt_tokens covers the user message and the facts retrieved for it)"""
+    __slots__ = ("messages", "prefix_tokens", "history_tokens", "prompt_tokens", "turns")
+
+    def __init__(self, messages: List[Dict[str, str]], prefix_tokens: int, history_tokens: int,
+                 prompt_tokens: int, turns: int):
+        self.messages = messages
+        self.prefix_tokens = prefix_tokens
+        self.history_tokens = history_tokens
+        self.prompt_tokens = prompt_tokens
+        self.turns = turns
+
+    @property
+    def tokens(self) -> int:
+        return self.prefix_tokens + self.history_tokens + self.prompt_tokens
+
+# channel.id -> (key, prefix messages, tokens): the prefix is only rebuilt when persona, tags or
+# the rolling summary change, so the exact same bytes start every prompt and Ollama's prefix cache stays warm.
+# Retrieved facts depend on the message, so they go after the history, next to the user turn.
+_prefixes: Dict[int, Tuple[tuple, List[Dict[str, str]], int]] = {}
+# channel.id -> token counts of the last request (estimate, plus Ollama's own counters)
+usage: Dict[int, Dict[str, int]] = {}
+
+def _prefix(channel_id: int, record: Optional[InstanceRecord]) -> Tuple[List[Dict[str, str]], int]:
+    base = record.persona if record else DEFAULT_SYSTEM
+    tags = tuple(record.tags) if record else ()
+    summary = record.summary if record else ""
+    key = (base, tags, summary)
+    cached = _prefixes.get(channel_id)
+    if cached and cached[0] == key:
+        return cached[1], cached[2]
+
+    system = base
+    mapped = [PERSONALITY_TAGS[tag] for tag in tags if tag in PERSONALITY_TAGS]
+    if mapped:
+        system += "\nPersonnalité: " + " ".join(mapped)
+    messages = [{"role": "system", "content": system}]
+    if summary:
+        # Stands in for the turns compacted out of the history
+        messages.append({"role": "system", "content": "Résumé de la conversation jusqu'ici:\n" + summary})
+    tokens = sum(estimate_tokens(message["content"]) for message in messages)
+    _prefixes[channel_id] = (key, messages, tokens)
+    return messages, tokens
+
+def build_instance_prompt(channel_id: int, user_prompt: str, budget: int = PROMPT_TOKEN_BUDGET) -> PromptBuild:
+    """System prefix, then as much recent history as fits the token budget (newest first), then the prompt"""
+    record = registry.get(channel_id)
+    prefix, prefix_tokens = _prefix(channel_id, record)
+    block = facts_block(record, user_prompt)
+    prompt_tokens = estimate_tokens(user_prompt) + (estimate_tokens(block) if block else 0)
+    room = budget - prefix_tokens - prompt_tokens
+
+    picked = []
+    history_tokens = 0
+    for entry in reversed(record.history if record else ()):
+        tokens = entry_tokens(entry)
+        if history_tokens + tokens > room:
+            break
+        picked.append(entry)
+        history_tokens += tokens
+    # Never open the history on an answer whose question was cut
+    if picked and picked[-1]["role"] == "assistant":
+        history_tokens -= entry_tokens(picked.pop())
+
+    messages = list(prefix)
+    messages.extend({"role": entry["role"], "content": entry["content"]} for entry in reversed(picked))
+    if block:
+        messages.append({"role": "system", "content": block})
+    messages.append({"role": "user", "content": user_prompt})
+    return PromptBuild(messages, prefix_tokens, history_tokens, prompt_tokens, len(picked))
+
+def build_messages_for_instance(channel_id: int, user_prompt: str) -> List[Dict[str, str]]:
+    return build_instance_prompt(channel_id, user_prompt).messages
+
+def record_usage(channel_id: int, build: PromptBuild, stats: Dict) -> Dict[str, int]:
+    """Remember what the last request of a channel cost"""
+    usage[channel_id] = entry = {
+        "estimated": build.tokens,
+        "history_turns": build.turns,
+        "prompt_eval_count": stats.get("prompt_eval_count", 0),
+        "eval_count": stats.get("eval_count", 0),
+    }
+    return entry
+
+def _forget(channel_id: int):
+    _prefixes.pop(channel_id, None)
+    usage.pop(channel_id, None)
+
+forget_hooks.append(_forget)
+unload_hooks.append(lambda channel_id: _prefixes.pop(channel_id, None))
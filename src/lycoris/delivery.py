@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import discord
+from collections import deque
+from typing import Deque, Dict, Optional, Set
+from .config import DELIVERY_SEND_INTERVAL
+from .utils import Pacer, split_discord
+
+# 5xx answers retried before a chunk is given up
+MAX_RETRIES = 3
+
+class _Outbox:
+    """Chunks waiting to go out in one channel, and the task sending them"""
+    __slots__ = ("channel", "chunks", "task", "pacer")
+
+    def __init__(self, channel: discord.abc.Messageable, interval: float):
+        self.channel = channel
+        self.chunks: Deque[str] = deque()
+        self.task: Optional[asyncio.Task] = None
+        self.pacer = Pacer(interval)
+
+class Delivery:
+    """One ordered outbound queue per channel.
+
+    send() chunks the text and returns at once; a task per busy channel posts the chunks
+    in order, spaced by `interval` and backing off when Discord answers 429. Channels
+    that were deleted (drop(), or a 404 from Discord) lose whatever was still queued.
+    """
+
+    def __init__(self, interval: float = DELIVERY_SEND_INTERVAL):
+        self.interval = interval
+        self._outboxes: Dict[int, _Outbox] = {}
+        self._gone: Set[int] = set()
+
+    def send(self, channel: discord.abc.Messageable, text: str):
+        """Queue a reply for `channel` (in order with earlier ones) without waiting for it"""
+        if channel.id in self._gone:
+            return
+        chunks = split_discord(text)
+        if not chunks:
+            return
+        box = self._outboxes.get(channel.id)
+        if box is None:
+            box = self._outboxes[channel.id] = _Outbox(channel, self.interval)
+        box.chunks.extend(chunks)
+        if box.task is None:
+            box.task = asyncio.create_task(self._drain(box))
+
+    def pending(self, channel_id: int) -> int:
+        box = self._outboxes.get(channel_id)
+        return len(box.chunks) if box else 0
+
+    def drop(self, channel_id: int):
+        """The channel is gone: forget its queue and refuse later sends"""
+        if len(self._gone) > 4096:
+            self._gone.clear()
+        self._gone.add(channel_id)
+        box = self._outboxes.pop(channel_id, None)
+        if box is not None:
+            box.chunks.clear()
+            if box.task is not None and box.task is not asyncio.current_task():
+                box.task.cancel()
+
+    async def flush(self, channel_id: Optional[int] = None):
+        """Wait until the queue of one channel (or of every channel) is empty"""
+        boxes = [self._outboxes.get(channel_id)] if channel_id is not None else list(self._outboxes.values())
+        tasks = [box.task for box in boxes if box is not None and box.task is not None]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def close(self):
+        await self.flush()
+
+    async def _drain(self, box: _Outbox):
+        channel = box.channel
+        retries = 0
+        try:
+            while box.chunks:
+                await box.pacer.wait()
+                try:
+                    await channel.send(box.chunks[0])
+                except discord.NotFound:
+                    logging.info(f"Lycoris::Delivery::{channel.id} no longer exists, {len(box.chunks)} chunks dropped")
+                    self.drop(channel.id)
+                    return
+                except discord.Forbidden as error:
+                    logging.warning(f"Lycoris::Delivery::Can't post in {channel}: {error}")
+                    box.chunks.clear()
+                    return
+                except discord.HTTPException as error:
+                    if error.status == 429:
+                        box.pacer.throttled(getattr(error, "retry_after", 0.0) or 0.0)
+                        continue
+                    if error.status >= 500 and retries < MAX_RETRIES:
+                        retries += 1
+                        box.pacer.throttled()
+                        continue
+                    logging.error(f"Lycoris::Delivery::Send failed in {channel}: {error}")
+                else:
+                    box.pacer.ok()
+                retries = 0
+                box.chunks.popleft()
+        finally:
+            box.task = None
+            if self._outboxes.get(channel.id) is box and not box.chunks:
+                del self._outboxes[channel.id]
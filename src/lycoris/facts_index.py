@@ -0,0 +1,116 @@
+import re
+import math
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Tuple
+
+TOKEN_RE = re.compile(r"\w+")
+# No English "the": accent folding turns "thé" into "the"
+STOPWORDS = {
+    "le", "la", "les", "un", "une", "des", "du", "de", "et", "ou", "en", "au", "aux", "a", "ce", "ces", "cet",
+    "cette", "est", "sont", "il", "elle", "ils", "elles", "je", "tu", "on", "nous", "vous", "que", "qui", "quoi",
+    "ne", "pas", "se", "sa", "son", "ses", "mon", "ma", "mes", "ton", "ta", "tes", "pour", "par", "sur", "dans",
+    "avec", "plus", "me", "te", "lui", "leur", "y", "d", "l", "j", "c", "s", "n", "m", "t", "qu",
+    "an", "and", "or", "of", "to", "in", "is", "are", "it", "i", "you", "my", "your", "for", "on", "with",
+}
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents so 'Thé' and 'the' index the same way"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_RE.findall(fold(text)) if token not in STOPWORDS]
+
+class FactsIndex:
+    """Incremental BM25 inverted index over the facts of one instance"""
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, items=()):
+        self._docs: Dict[int, Tuple[str, int]] = {}           # doc id -> (fact, length)
+        self._postings: Dict[str, Dict[int, int]] = {}        # term -> {doc id: term frequency}
+        self._by_text: Dict[str, List[int]] = {}              # fact -> doc ids, oldest first
+        self._total_length = 0
+        self._next_id = 0
+        for item in items:
+            self.add(item)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, fact: str):
+        doc_id = self._next_id
+        self._next_id += 1
+        terms = Counter(tokenize(fact))
+        length = sum(terms.values())
+        self._docs[doc_id] = (fact, length)
+        self._total_length += length
+        self._by_text.setdefault(fact, []).append(doc_id)
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, fact: str):
+        """Remove the oldest entry holding this exact fact"""
+        ids = self._by_text.get(fact)
+        if not ids:
+            return
+        doc_id = ids.pop(0)
+        if not ids:
+            del self._by_text[fact]
+        _, length = self._docs.pop(doc_id)
+        self._total_length -= length
+        for term in set(tokenize(fact)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def clear(self):
+        self._docs.clear()
+        self._postings.clear()
+        self._by_text.clear()
+        self._total_length = 0
+
+    def search(self, query: str, k: int, char_budget: int) -> List[str]:
+        """Best facts for a query (ties go to the most recent), within k items and char_budget chars"""
+        if not self._docs:
+            return []
+        count = len(self._docs)
+        average = self._total_length / count or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                length = self._docs[doc_id][1]
+                norm = tf + self.K1 * (1 - self.B + self.B * length / average)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.K1 + 1) / norm
+
+        picked, used = [], 0
+        for doc_id in sorted(scores, key=lambda doc_id: (-scores[doc_id], -doc_id)):
+            fact = self._docs[doc_id][0]
+            if used + len(fact) > char_budget:
+                continue
+            picked.append(fact)
+            used += len(fact)
+            if len(picked) >= k:
+                break
+        return picked
+
+    def recent(self, k: int, char_budget: int) -> List[str]:
+        """Latest facts within k items and char_budget chars, oldest first"""
+        picked, used = [], 0
+        for doc_id in sorted(self._docs, reverse=True):
+            fact = self._docs[doc_id][0]
+            if used + len(fact) > char_budget:
+                continue
+            picked.append(fact)
+            used += len(fact)
+            if len(picked) >= k:
+                break
+        picked.reverse()
+        return picked
@@ -1,22 +1,24 @@
 import re
+import time
+import asyncio
 import discord
 import logging
-from typing import Optional
-from .config import INSTANCE_CATEGORY_NAME, DEFAULT_SYSTEM
-from .state import memory, facts, personas, instance_tags, user_instances, instance_owner
+import contextlib
+from typing import Dict, List, Optional, Set, Tuple
+from .config import (
+    INSTANCE_CATEGORY_NAME, REHYDRATE_CONCURRENCY, REHYDRATE_GUILD_CONCURRENCY, TOPIC_REPAIR_DELAY,
+)
+from .state import registry
+from .pool import pool, get_or_create_category, hidden_overwrites, is_pool_channel
 
 OWNER_TAG_RE = re.compile(r"\blyc-owner:(\d{5,})\b")
 
-async def get_or_create_category(guild: discord.Guild) -> discord.CategoryChannel:
-    """Create the dedicated Lycoris category or create it if missing"""
-    category = discord.utils.get(guild.categories, name=INSTANCE_CATEGORY_NAME)
-    if category:
-        return category
-    return await guild.create_category(INSTANCE_CATEGORY_NAME, reason="Lycoris: catégorie d'instances")
+_guild_locks: Dict[int, asyncio.Lock] = {}
+_background: Set[asyncio.Task] = set()
 
 async def create_instance(guild: discord.Guild, user: discord.Member) -> Optional[discord.TextChannel]:
-    """Create a private channel for one user with Lycoris. Limit of 2 instances per user"""
-    if len(user_instances[user.id]) >= 2:
+    """Create a private channel for one user with Lycoris. Limit of 2 instances per user and guild"""
+    if registry.count_for(guild.id, user.id) >= 2:
         return None
 
     category = await get_or_create_category(guild)
@@ -29,28 +31,19 @@ async def create_instance(guild: discord.Guild, user: discord.Member) -> Optiona
         suffix += 1
         channel_name = f"{name}-{suffix}"
 
-    overwrites = {
-        guild.default_role: discord.PermissionOverwrite(view_channel=False),
-        user:   discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True),
-        guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True, manage_channels=True),
-    }
-    
-    channel = await guild.create_text_channel(
-        channel_name, category=category, overwrites=overwrites, 
-        reason=f"Lycoris: instance privée pour {user}"
-    )
-    
-    try:
-        await channel.edit(topic=f"lyc-owner:{user.id}")
-    except discord.Forbidden:
-        logging.info("Lycoris::Instances::Cannot edit topic to tag owner (missing perms)")
+    overwrites = hidden_overwrites(guild)
+    overwrites[user] = discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True)
+    topic = f"lyc-owner:{user.id}"
+
+    # A spare channel takes one edit; otherwise the owner tag goes in with the creation
+    channel = await pool.claim(guild, user, channel_name, topic, overwrites)
+    if channel is None:
+        channel = await guild.create_text_channel(
+            channel_name, category=category, overwrites=overwrites, topic=topic,
+            reason=f"Lycoris: instance privée pour {user}"
+        )
 
-    user_instances[user.id].append(channel.id)
-    instance_owner[channel.id] = user.id
-    personas[channel.id] = DEFAULT_SYSTEM
-    instance_tags[channel.id] = []
-    memory[channel.id].clear()
-    facts[channel.id].clear()
+    registry.create(channel.id, guild.id, user.id)
 
     await channel.send(
         f"Bienvenue {user.mention} ! Cette instance est privée entre nous. "
@@ -61,15 +54,7 @@ async def create_instance(guild: discord.Guild, user: discord.Member) -> Optiona
 
 async def close_instance(channel: discord.TextChannel, reason: str = "Instance fermée. À bientôt !"):
     """Clean internal maps and delete the channel"""
-    owner_id = instance_owner.get(channel.id)
-    if owner_id and channel.id in user_instances.get(owner_id, []):
-        user_instances[owner_id] = [cid for cid in user_instances[owner_id] if cid != channel.id]
-
-    memory.pop(channel.id, None)
-    facts.pop(channel.id, None)
-    personas.pop(channel.id, None)
-    instance_tags.pop(channel.id, None)
-    instance_owner.pop(channel.id, None)
+    registry.remove(channel.id)
 
     try:
         await channel.send(reason)
@@ -82,6 +67,7 @@ def _looks_like_instance(channel: discord.TextChannel) -> bool:
         and channel.category
         and channel.category.name == INSTANCE_CATEGORY_NAME
         and channel.name.startswith("lycoris-")
+        and not is_pool_channel(channel)
     )
 
 def _slugify(name: str) -> str:
@@ -95,47 +81,100 @@ def _slug_from_channel_name(ch: discord.TextChannel) -> str:
     tail = re.sub(r"-\d+$", "", tail)
     return tail
 
-async def _detect_owner(channel: discord.TextChannel, bot_user: discord.ClientUser) -> Optional[discord.Member]:
-    """Find instance owner using topic tag, overwrites, or members list"""
-    # 1. Topic tag
-    if channel.topic:
-        m = OWNER_TAG_RE.search(channel.topic)
-        if m:
-            uid = int(m.group(1))
-            member = channel.guild.get_member(uid)
-            if member is None:
+class StageTimer:
+    """Accumulate wall time and call counts per detection stage"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            total = self.stages.setdefault(name, [0.0, 0])
+            total[0] += time.perf_counter() - begin
+            total[1] += 1
+
+    def report(self) -> str:
+        parts = [f"{name} {spent:.2f}s ({count})" for name, (spent, count) in sorted(self.stages.items())]
+        return f"{time.perf_counter() - self.started:.2f}s — " + (", ".join(parts) or "nothing to scan")
+
+class _GuildIndex:
+    """Per-guild member lookups for rehydration: batched fetches and a slug index built once"""
+
+    def __init__(self, guild: discord.Guild, timer: StageTimer):
+        self.guild = guild
+        self.timer = timer
+        self._missing: Set[int] = set()
+        self._slugs: Optional[Dict[str, discord.Member]] = None
+
+    async def prefetch(self, user_ids: Set[int]):
+        """Load uncached members with one gateway query per 100 ids"""
+        wanted = [uid for uid in user_ids if self.guild.get_member(uid) is None]
+        with self.timer.stage("fetch"):
+            for index in range(0, len(wanted), 100):
+                batch = wanted[index:index + 100]
                 try:
-                    member = await channel.guild.fetch_member(uid)
-                except discord.NotFound:
-                    member = None
-            if member and not member.bot:
-                return member
+                    await self.guild.query_members(user_ids=batch, limit=len(batch), cache=True)
+                except (asyncio.TimeoutError, discord.ClientException, discord.HTTPException) as error:
+                    logging.info(f"Lycoris::Instances::Batched member query failed in {self.guild}: {error}")
+                    return
+        self._missing.update(uid for uid in wanted if self.guild.get_member(uid) is None)
+
+    async def member(self, uid: int) -> Optional[discord.Member]:
+        member = self.guild.get_member(uid)
+        if member is not None or uid in self._missing:
+            return member
+        with self.timer.stage("fetch"):
+            try:
+                return await self.guild.fetch_member(uid)
+            except discord.NotFound:
+                self._missing.add(uid)
+                return None
+
+    def by_slug(self, slug: str) -> Optional[discord.Member]:
+        if self._slugs is None:
+            self._slugs = {}
+            for member in getattr(self.guild, "members", []):
+                if not member.bot:
+                    self._slugs.setdefault(_slugify(member.display_name), member)
+        return self._slugs.get(slug)
+
+async def _detect_owner(channel: discord.TextChannel, index: _GuildIndex, tagged_uid: Optional[int]) -> Optional[discord.Member]:
+    """Find instance owner using topic tag, overwrites, or members list"""
+    timer = index.timer
+    # 1. Topic tag (members were prefetched in batch)
+    if tagged_uid:
+        member = await index.member(tagged_uid)
+        if member and not member.bot:
+            return member
 
     # 2. Overwrites
-    for target, perms in channel.overwrites.items():
-        if isinstance(target, discord.Member) and not target.bot and perms.view_channel:
-            return target
+    with timer.stage("overwrites"):
+        for target, perms in channel.overwrites.items():
+            if isinstance(target, discord.Member) and not target.bot and perms.view_channel:
+                return target
 
     # 3. Search any user in channel
-    for member in channel.members:
-        if not member.bot:
-            return member
+    with timer.stage("members"):
+        for member in channel.members:
+            if not member.bot:
+                return member
     
     # 4. First speaker who wasn't Lycoris
     try:
-        async for msg in channel.history(limit=50, oldest_first=False):
-            author = msg.author
+        with timer.stage("history"):
+            authors = [msg.author async for msg in channel.history(limit=50, oldest_first=False)]
+        for author in authors:
             if getattr(author, "bot", False):
                 continue
             uid = getattr(author, "id", None)
             if not uid:
                 continue
-            member = channel.guild.get_member(uid)
-            if member is None:
-                try:
-                    member = await channel.guild.fetch_member(uid)
-                except discord.NotFound:
-                    member = None
+            member = await index.member(uid)
             if member and not member.bot:
                 return member
     except discord.Forbidden:
@@ -144,53 +183,100 @@ async def _detect_owner(channel: discord.TextChannel, bot_user: discord.ClientUs
     # 5. Check by slug name
     slug = _slug_from_channel_name(channel)
     if slug:
-        for member in getattr(channel.guild, "members", []):
-            if member.bot:
-                continue
-            if _slugify(member.display_name) == slug:
-                return member
+        with timer.stage("slug"):
+            return index.by_slug(slug)
 
     return None
 
-async def rehydrate_guild(guild: discord.Guild, bot_user: discord.ClientUser) -> int:
-    """Rebuild in-memory maps for existing instance channels at startup"""
-    category = discord.utils.get(guild.categories, name=INSTANCE_CATEGORY_NAME)
-    if not category:
-        return 0
-
-    restored = 0
-    for channel in category.text_channels:
-        if not _looks_like_instance(channel) or channel.id in instance_owner:
-            continue
-
-        # 1. Detect owner
-        owner = await _detect_owner(channel, bot_user)
-        if not owner:
-            logging.warning(f"Lycoris::Instances::None owner found for {channel} (id={channel.id}), topic={channel.topic!r} — skipped")
-            continue
-
-        # 2. Store topic tag if mising
-        if not (channel.topic and OWNER_TAG_RE.search(channel.topic)):
-            try:
-                await channel.edit(topic=f"lyc-owner:{owner.id}")
-            except discord.Forbidden:
-                logging.info(f"Lycoris::Instances:: Can't edit topic from {channel}")
-
-        # 3. Rebuild RAM
-        instance_owner[channel.id] = owner.id
-        if channel.id not in user_instances[owner.id]:
-            user_instances[owner.id].append(channel.id)
-        personas.setdefault(channel.id, DEFAULT_SYSTEM)
-        instance_tags.setdefault(channel.id, [])
-        memory[channel.id]
-        facts[channel.id]
-        restored += 1
-        logging.info(f"[rehydrate] {guild.name} → {channel.name} owner={owner} (id={owner.id})")
+async def _repair_topics(repairs: List[Tuple[discord.TextChannel, int]]):
+    """Store missing owner tags in channel topics, paced so startup doesn't burn the rate limit"""
+    for channel, owner_id in repairs:
+        try:
+            await channel.edit(topic=f"lyc-owner:{owner_id}")
+        except discord.Forbidden:
+            logging.info(f"Lycoris::Instances:: Can't edit topic from {channel}")
+        except discord.HTTPException as error:
+            logging.info(f"Lycoris::Instances::Topic repair failed for {channel}: {error}")
+        await asyncio.sleep(TOPIC_REPAIR_DELAY)
+
+async def rehydrate_guild(guild: discord.Guild, bot_user: discord.ClientUser, timer: Optional[StageTimer] = None) -> int:
+    """Rebuild in-memory maps for instance channels the store doesn't know yet"""
+    # on_ready and on_guild_available can both ask for the same guild
+    async with _guild_locks.setdefault(guild.id, asyncio.Lock()):
+        # Instances known by the store but deleted while the bot was offline (with their
+        # category, possibly: they would count against their owner's limit for good)
+        for channel_id in registry.guild_channels(guild.id):
+            if guild.get_channel(channel_id) is None:
+                registry.remove(channel_id)
+
+        category = discord.utils.get(guild.categories, name=INSTANCE_CATEGORY_NAME)
+        if not category:
+            return 0
+        report = timer is None
+        timer = timer or StageTimer()
+
+        # Spare channels go back to the pool, which tops itself up from there
+        for channel in category.text_channels:
+            if is_pool_channel(channel) and channel.id not in registry:
+                pool.adopt(channel)
+        pool.refill(guild)
+
+        channels = [ch for ch in category.text_channels if _looks_like_instance(ch) and ch.id not in registry]
+        if not channels:
+            return 0
+
+        # 1. Owner tags from topics, members fetched in batches
+        index = _GuildIndex(guild, timer)
+        with timer.stage("topic"):
+            tagged = {}
+            for channel in channels:
+                match = OWNER_TAG_RE.search(channel.topic or "")
+                if match:
+                    tagged[channel.id] = int(match.group(1))
+        await index.prefetch(set(tagged.values()))
+
+        # 2. Detect owners concurrently
+        limit = asyncio.Semaphore(REHYDRATE_CONCURRENCY)
+
+        async def detect(channel: discord.TextChannel) -> Optional[discord.Member]:
+            async with limit:
+                return await _detect_owner(channel, index, tagged.get(channel.id))
+
+        owners = await asyncio.gather(*(detect(channel) for channel in channels))
+
+        restored = 0
+        repairs = []
+        for channel, owner in zip(channels, owners):
+            if not owner:
+                logging.warning(f"Lycoris::Instances::None owner found for {channel} (id={channel.id}), topic={channel.topic!r} — skipped")
+                continue
+
+            # 3. Store topic tag if mising (deferred, see _repair_topics)
+            if tagged.get(channel.id) != owner.id:
+                repairs.append((channel, owner.id))
+
+            # 4. Rebuild RAM
+            registry.create(channel.id, guild.id, owner.id)
+            restored += 1
+            logging.info(f"[rehydrate] {guild.name} → {channel.name} owner={owner} (id={owner.id})")
+
+    if repairs:
+        task = asyncio.create_task(_repair_topics(repairs))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    if report:
+        logging.info(f"Lycoris::Instances::{guild.name} rehydrated in {timer.report()}")
     return restored
 
 async def rehydrate_all(bot) -> int:
-    total = 0
-    for guild in bot.guilds:
-        total += await rehydrate_guild(guild, bot.user)
+    timer = StageTimer()
+    limit = asyncio.Semaphore(REHYDRATE_GUILD_CONCURRENCY)
+
+    async def one(guild: discord.Guild) -> int:
+        async with limit:
+            return await rehydrate_guild(guild, bot.user, timer)
+
+    total = sum(await asyncio.gather(*(one(guild) for guild in bot.guilds)))
     logging.info(f"Lycoris::Instances::Instances restored: {total}")
-    return total
\ No newline at end of file
+    logging.info(f"Lycoris::Instances::Rehydration timing: {timer.report()}")
+    return total
@@ -0,0 +1,108 @@
+import re
+from typing import Dict, FrozenSet, Iterable, Optional, Set
+from .config import (
+    CREATE_PHRASE, COUNT_WORDS, INSTANCE_WORDS, PURGE_WORDS, GOODBYE_WORDS, CANCEL_WORDS,
+    CREATE_VERBS, PRIVATE_WORDS, PLACE_WORDS,
+)
+
+# --- Intents returned by classify()
+PURGE   = "purge"
+COUNT   = "count"
+CREATE  = "create"
+GOODBYE = "goodbye"
+TAGS    = "tags"
+CANCEL  = "cancel"
+
+TOKEN_RE = re.compile(r"\w+")
+TAGS_RE = re.compile(r"(?<!\w)tags?\s*:\s*(.+)$", re.I)
+CREATE_PHRASE_RE = re.compile(rf"\b(?x:{CREATE_PHRASE})\b", re.I)
+# Every alternative of CREATE_PHRASE needs one of these tokens (or a token containing "priv")
+CREATE_PHRASE_ANCHORS = {"ouvre", "ouvrer", "cre", "cré", "cree", "crée", "creer", "créer", "open", "create", "mp", "dm"}
+
+class IntentMatch:
+    """Every intent found in one message, plus the value of a `tags:` command"""
+    __slots__ = ("intents", "tags")
+
+    def __init__(self, intents: FrozenSet[str], tags: Optional[str] = None):
+        self.intents = intents
+        self.tags = tags
+
+    def __contains__(self, intent: str) -> bool:
+        return intent in self.intents
+
+    def __repr__(self) -> str:
+        return f"IntentMatch({sorted(self.intents)}, tags={self.tags!r})"
+
+class IntentEngine:
+    """Keyword automaton over word tokens: one pass looks every token (and token pair,
+    for keywords like "au revoir") up in a single table, so matches always fall on
+    word boundaries. Intents are then derived from the collected features."""
+
+    def __init__(self, keyword_sets: Dict[str, Iterable[str]]):
+        self._words: Dict[str, Set[str]] = {}
+        self._pairs: Dict[str, Dict[str, Set[str]]] = {}
+        for feature, words in keyword_sets.items():
+            for word in words:
+                tokens = TOKEN_RE.findall(word.casefold())
+                if len(tokens) == 1:
+                    self._words.setdefault(tokens[0], set()).add(feature)
+                elif len(tokens) == 2:
+                    self._pairs.setdefault(tokens[0], {}).setdefault(tokens[1], set()).add(feature)
+                    # "aurevoir", "peuxtu"... written without a space
+                    self._words.setdefault("".join(tokens), set()).add(feature)
+                else:
+                    raise ValueError(f"keywords are limited to two words: {word!r}")
+
+    def features(self, tokens) -> Set[str]:
+        found: Set[str] = set()
+        words, pairs = self._words, self._pairs
+        last = len(tokens) - 1
+        for index, token in enumerate(tokens):
+            hit = words.get(token)
+            if hit:
+                found |= hit
+            follow = pairs.get(token)
+            if follow and index < last:
+                hit = follow.get(tokens[index + 1])
+                if hit:
+                    found |= hit
+        return found
+
+    def scan(self, text: str) -> IntentMatch:
+        text = text or ""
+        tokens = TOKEN_RE.findall(text.casefold())
+        found = self.features(tokens)
+        intents = set()
+        if "purge" in found:
+            intents.add(PURGE)
+        if "count" in found and "instance" in found:
+            intents.add(COUNT)
+        if "private" in found and ("place" in found or "verb" in found):
+            intents.add(CREATE)
+        elif any(t in CREATE_PHRASE_ANCHORS or "priv" in t for t in tokens) and CREATE_PHRASE_RE.search(text):
+            intents.add(CREATE)
+        if "goodbye" in found:
+            intents.add(GOODBYE)
+        if "cancel" in found:
+            intents.add(CANCEL)
+        tags = None
+        if ":" in text:
+            match = TAGS_RE.search(text)
+            if match:
+                intents.add(TAGS)
+                tags = match.group(1)
+        return IntentMatch(frozenset(intents), tags)
+
+ENGINE = IntentEngine({
+    "purge":    PURGE_WORDS,
+    "goodbye":  GOODBYE_WORDS,
+    "cancel":   CANCEL_WORDS,
+    "count":    COUNT_WORDS,
+    "instance": INSTANCE_WORDS,
+    "private":  PRIVATE_WORDS,
+    "place":    PLACE_WORDS,
+    "verb":     CREATE_VERBS,
+})
+
+def classify(text: str) -> IntentMatch:
+    return ENGINE.scan(text)
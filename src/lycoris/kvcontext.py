@@ -0,0 +1,127 @@
+from array import array
+from typing import Dict, List, Optional, Tuple
+from .config import LLM_KV_CONTEXT_MAX
+from .context import PromptBuild, facts_block
+from .state import InstanceRecord, forget_hooks, unload_hooks
+from . import metrics
+
+KV_TURNS = metrics.Counter("lycoris_kv_turns_total", "Instance turns on /api/generate, reused or rebuilt context", ("mode",))
+KV_SAVED = metrics.Counter("lycoris_kv_prompt_eval_saved_seconds_total",
+                           "Estimated prompt evaluation time saved by reusing Ollama contexts")
+
+def fingerprint(record: InstanceRecord, model: str) -> Tuple:
+    """What the context was built from, besides the history: any change means a rebuild
+    (a context is made of the model's own tokens, so a tier switch is one too)"""
+    return model, record.persona, tuple(record.tags), record.summary, hash(tuple(record.facts))
+
+def render(messages: List[Dict[str, str]]) -> Tuple[str, str]:
+    """A chat prompt as /api/generate fields: the leading system messages, then the history as
+    a transcript, the retrieved facts and the user message"""
+    lead = 0
+    while lead < len(messages) - 1 and messages[lead]["role"] == "system":
+        lead += 1
+    system = "\n\n".join(message["content"] for message in messages[:lead])
+    transcript, notes = [], []
+    for message in messages[lead:-1]:
+        if message["role"] == "system":
+            notes.append(message["content"])
+        else:
+            speaker = "Utilisateur" if message["role"] == "user" else "Lycoris"
+            transcript.append(f"{speaker}: {message['content']}")
+    parts = ["Conversation jusqu'ici:\n" + "\n".join(transcript)] if transcript else []
+    parts += notes
+    parts.append(messages[-1]["content"])
+    return system, "\n\n".join(parts)
+
+class Session:
+    """Ollama context of a channel's last turn, the node holding its KV cache, and the
+    history entry it ends on"""
+    __slots__ = ("fingerprint", "context", "backend", "anchor")
+
+    def __init__(self, fingerprint: Tuple, context: List[int], backend: Optional[str]):
+        self.fingerprint = fingerprint
+        self.context = array("i", context)   # 4 bytes a token instead of ~36 in a list of ints
+        self.backend = backend
+        self.anchor: Optional[Dict] = None
+
+class GenerateRequest:
+    __slots__ = ("prompt", "system", "context", "prefer", "reused", "fingerprint")
+
+    def __init__(self, prompt: str, system: Optional[str], context: Optional[List[int]], prefer: Optional[str],
+                 reused: bool, fingerprint: Tuple):
+        self.prompt = prompt
+        self.system = system
+        self.context = context
+        self.prefer = prefer
+        self.reused = reused
+        self.fingerprint = fingerprint
+
+class KVSessions:
+    """Per-channel Ollama contexts for instances (LLM_KV_CONTEXT).
+
+    request() sends only the new turn on top of the channel's last context when nothing
+    else changed, and the whole prompt otherwise. finished() keeps the context Ollama
+    returned; commit() adopts it once the turn is in the history, so a cancelled or failed
+    turn leaves the channel to be rebuilt.
+    """
+
+    def __init__(self, max_tokens: int = LLM_KV_CONTEXT_MAX):
+        self.max_tokens = max_tokens
+        self._sessions: Dict[int, Session] = {}
+        self._pending: Dict[int, Session] = {}
+        self.ns_per_token = 0.0   # prompt evaluation speed seen on full prompts (moving average)
+        self.saved = 0.0          # seconds of prompt evaluation skipped so far (estimate)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def request(self, record: InstanceRecord, build: PromptBuild, model: str) -> GenerateRequest:
+        key = fingerprint(record, model)
+        session = self._sessions.get(record.channel_id)
+        if (session is not None and session.fingerprint == key and len(session.context) <= self.max_tokens
+                and record.history and record.history[-1] is session.anchor):
+            turn = build.messages[-1]["content"]
+            block = facts_block(record, turn)
+            prompt = f"{block}\n\n{turn}" if block else turn
+            return GenerateRequest(prompt, None, session.context.tolist(), session.backend, True, key)
+        system, prompt = render(build.messages)
+        return GenerateRequest(prompt, system, None, None, False, key)
+
+    def finished(self, channel_id: int, request: GenerateRequest, stats: Dict) -> Optional[float]:
+        """Record a generation; returns the prompt evaluation time it saved (s) when it reused a context"""
+        count, duration = stats.get("prompt_eval_count"), stats.get("prompt_eval_duration")
+        saved = None
+        if request.reused:
+            KV_TURNS.inc(1, "reused")
+            if self.ns_per_token:
+                saved = len(request.context) * self.ns_per_token / 1e9
+                self.saved += saved
+                KV_SAVED.inc(saved)
+        else:
+            KV_TURNS.inc(1, "rebuilt")
+            if count and duration:
+                rate = duration / count
+                self.ns_per_token = rate if not self.ns_per_token else self.ns_per_token * 0.8 + rate * 0.2
+        context = stats.get("context")
+        if context:
+            self._pending[channel_id] = Session(request.fingerprint, context, stats.get("backend"))
+        else:
+            self._pending.pop(channel_id, None)
+        return saved
+
+    def commit(self, channel_id: int, anchor: Dict):
+        """The turn is in the history, ending on `anchor`: its context is the one to continue from"""
+        session = self._pending.pop(channel_id, None)
+        if session is None:
+            self._sessions.pop(channel_id, None)
+            return
+        session.anchor = anchor
+        self._sessions[channel_id] = session
+
+    def forget(self, channel_id: int):
+        self._sessions.pop(channel_id, None)
+        self._pending.pop(channel_id, None)
+
+sessions = KVSessions()
+forget_hooks.append(sessions.forget)
+unload_hooks.append(sessions.forget)
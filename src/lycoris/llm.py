@@ -1,43 +1,650 @@
+import json
+import time
+import asyncio
 import logging
+import weakref
+import contextlib
 import httpx
-from typing import List, Dict
-from .config import OLLAMA_URL, OLLAMA_MODEL, TEMPERATURE
-
-async def healthcheck_ollama():
-    """Log whether the configured model is available on the Ollama daemon"""
-    try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            response = await client.get(f"{OLLAMA_URL}/api/tags")
-            response.raise_for_status()
-            names = {model.get("name") or model.get("model") for model in response.json().get("models", [])}
-            if OLLAMA_MODEL not in names:
-                logging.warning(f"Lycoris::LLM::Can't found '{OLLAMA_MODEL}' Ollama model. `ollama pull {OLLAMA_MODEL}`")
-            else:
-                logging.info(f"Lycoris::LLM::Ollama OK — model: {OLLAMA_MODEL}")
-    except Exception as error:
-        logging.error(f"Lycoris::LLM::No response from Ollama {error}")
-
-async def reply(messages: List[Dict[str, str]]) -> str:
-    """Send a chat request to the local Ollama server and return text content"""
-    payload = {
-        "model": OLLAMA_MODEL,
-        "messages": messages,
-        "stream": False,
-        "options": {"temperature": TEMPERATURE},
-    }
-    try:
-        async with httpx.AsyncClient(timeout=60) as client:
-            response = await client.post(f"{OLLAMA_URL}/api/chat", json=payload)
-            response.raise_for_status()
-            data = response.json()
-            message = data.get("message") or {}
-            content = (message.get("content") or "").strip()
-            return content or "Réponse vide."
-    except httpx.HTTPStatusError as error:
+from collections import deque
+from typing import Deque, List, Dict, Optional, AsyncIterator, Iterable, Sequence, Set, Tuple, Union
+from .scheduler import FairQueue, Flow
+from . import metrics
+from .config import (
+    OLLAMA_URLS, TEMPERATURE,
+    LLM_TIMEOUT, LLM_MAX_INFLIGHT, LLM_QUEUE_TIMEOUT, LLM_POOL_CONNECTIONS, LLM_POOL_KEEPALIVE,
+    LLM_PROBE_INTERVAL, LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN, LLM_KEEP_ALIVE, LLM_IDLE_RELEASE,
+    LLM_MODEL_FAST, LLM_MODEL_LARGE, LLM_TIER_LONG_PROMPT, LLM_TIER_QUEUE_DEPTH, LLM_TIER_P95_TARGET, LLM_TIER_WINDOW,
+)
+
+# Counters Ollama reports on the final response of a generation
+STAT_KEYS = ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration", "load_duration", "total_duration")
+# Failures that happen before Ollama starts working on a request: safe to send it elsewhere
+RETRYABLE = (httpx.ConnectError, httpx.TimeoutException)
+
+# What chat() answers when the model said nothing
+EMPTY_REPLY = "Réponse vide."
+# How often a background request checks whether a slot has become free
+BACKGROUND_POLL = 0.5
+BACKGROUND_FLOWS: Flow = ((("background",), 1.0),)
+
+# Model tiers
+FAST = "fast"
+LARGE = "large"
+# Latencies a tier needs in its window before its p95 is trusted
+TIER_MIN_SAMPLES = 5
+
+class QueueTimeout(Exception):
+    """Raised when a request waited too long for a free Ollama slot"""
+
+class Preempted(Exception):
+    """Raised when a background request was cancelled to make room for interactive traffic"""
+
+def describe_error(error: Exception) -> str:
+    """Turn a client error into the text shown to Discord users"""
+    if isinstance(error, QueueTimeout):
+        return "Je suis très sollicitée en ce moment, réessaie dans un instant."
+    if isinstance(error, httpx.HTTPStatusError):
         return f"Erreur Ollama (HTTP {error.response.status_code}) : {error.response.text[:400]}"
-    except httpx.ConnectError:
+    if isinstance(error, httpx.ConnectError):
         return "Impossible de joindre Ollama. Vérifie qu'il tourne."
-    except httpx.TimeoutException:
+    if isinstance(error, httpx.TimeoutException):
         return "Délai dépassé en interrogeant Ollama."
-    except Exception as error:
-        return f"Erreur IA : {error}"
+    return f"Erreur IA : {error}"
+
+class Backend:
+    """One Ollama node: its connection pool, the models it serves, its circuit breaker and stats"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.http: Optional[httpx.AsyncClient] = None
+        self.models: Optional[Set[str]] = None   # unknown until the first /api/tags probe
+        self.outstanding = 0
+        self.failures = 0                        # consecutive, resets on success
+        self.open_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.latency: Optional[float] = None     # moving average of requests (s), None until one completes
+        self.reachable: Optional[bool] = None    # last /api/tags probe answered
+
+    def available(self, now: float) -> bool:
+        if self.failures < LLM_BREAKER_FAILURES:
+            return True
+        # Open circuit: after the cooldown, let a single trial request through (half-open)
+        return now >= self.open_until and self.outstanding == 0
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models or f"{model}:latest" in self.models
+
+    def succeeded(self, latency: float):
+        if self.failures >= LLM_BREAKER_FAILURES:
+            logging.info(f"Lycoris::LLM::{self.url} is back")
+        self.failures = 0
+        self._measure(latency)
+
+    def failed(self, error: Exception):
+        self.errors += 1
+        self.failures += 1
+        # A failure weighs like a request that ran into the timeout, so routing shies away for a while
+        self._measure(LLM_TIMEOUT)
+        metrics.BACKEND_ERRORS.inc(1, self.url, type(error).__name__)
+        if self.failures >= LLM_BREAKER_FAILURES:
+            self.open_until = time.monotonic() + LLM_BREAKER_COOLDOWN
+            logging.warning(f"Lycoris::LLM::{self.url} skipped for {LLM_BREAKER_COOLDOWN:.0f}s "
+                            f"after {self.failures} failures ({error!r})")
+
+    def _measure(self, latency: float):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+    def rank(self) -> Tuple:
+        """Routing order: least outstanding work, then nodes without recent failures, then
+        proven (measured) nodes before unmeasured ones, then the fastest"""
+        return self.outstanding, self.failures > 0, self.latency is None, self.latency or 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "url": self.url,
+            "up": self.failures < LLM_BREAKER_FAILURES,
+            "reachable": self.reachable,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "models": sorted(self.models) if self.models is not None else None,
+        }
+
+class Tier:
+    """A model and the latencies of its recent replies (slot wait excluded)"""
+
+    def __init__(self, name: str, model: str, window: float = LLM_TIER_WINDOW):
+        self.name = name
+        self.model = model
+        self.window = window
+        self._samples: Deque[Tuple[float, float]] = deque()   # (time.monotonic(), seconds)
+
+    def observe(self, latency: float):
+        self._samples.append((time.monotonic(), latency))
+        metrics.TIER_LATENCY.observe(latency, self.name)
+
+    def p95(self) -> Optional[float]:
+        """95th percentile over the window, None until there are TIER_MIN_SAMPLES of them"""
+        horizon = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < horizon:
+            self._samples.popleft()
+        if len(self._samples) < TIER_MIN_SAMPLES:
+            return None
+        ordered = sorted(latency for _, latency in self._samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+class TierChoice:
+    """The tier a request runs on, and why (recorded with its reply)"""
+    __slots__ = ("tier", "reason")
+
+    def __init__(self, tier: Tier, reason: str):
+        self.tier = tier
+        self.reason = reason
+
+    @property
+    def name(self) -> str:
+        return self.tier.name
+
+    @property
+    def model(self) -> str:
+        return self.tier.model
+
+class TierRouter:
+    """Picks the model a request runs on.
+
+    Callers ask for a tier (FAST for the general channel, LARGE for instances). A long
+    prompt moves a fast request up to the large model; the large tier falls back to the
+    fast one while `queue_depth` requests wait for a slot, or while its p95 latency is
+    above `p95_target`. Its latencies age out of the window, so once the load is gone
+    the large model gets its requests back.
+    """
+
+    def __init__(self, fast: str = LLM_MODEL_FAST, large: str = LLM_MODEL_LARGE, long_prompt: int = LLM_TIER_LONG_PROMPT,
+                 queue_depth: int = LLM_TIER_QUEUE_DEPTH, p95_target: float = LLM_TIER_P95_TARGET,
+                 window: float = LLM_TIER_WINDOW):
+        self.tiers = {FAST: Tier(FAST, fast, window), LARGE: Tier(LARGE, large, window)}
+        self.long_prompt = long_prompt
+        self.queue_depth = queue_depth
+        self.p95_target = p95_target
+        self.degraded = False
+        self.replies: Dict[str, int] = {}
+
+    def __getitem__(self, name: str) -> Tier:
+        return self.tiers[name]
+
+    def models(self) -> List[str]:
+        return list(dict.fromkeys(tier.model for tier in self.tiers.values()))
+
+    def _slow(self) -> bool:
+        p95 = self.tiers[LARGE].p95() if self.p95_target > 0 else None
+        slow = p95 is not None and p95 > self.p95_target
+        if slow != self.degraded:
+            self.degraded = slow
+            if slow:
+                logging.warning(f"Lycoris::LLM::{self.tiers[LARGE].model} p95 {p95:.1f}s over {self.p95_target:.1f}s, "
+                                f"large tier requests go to {self.tiers[FAST].model}")
+            else:
+                logging.info(f"Lycoris::LLM::{self.tiers[LARGE].model} back under its latency target")
+        return slow
+
+    def choose(self, requested: str, prompt_tokens: int, waiting: int) -> TierChoice:
+        name, reason = requested, "requested"
+        if name == FAST and 0 < self.long_prompt <= prompt_tokens:
+            name, reason = LARGE, "long_prompt"
+        if name == LARGE:
+            if 0 < self.queue_depth <= waiting:
+                name, reason = FAST, "queue"
+            elif self._slow():
+                name, reason = FAST, "p95"
+        return TierChoice(self.tiers[name], reason)
+
+    def replied(self, choice: TierChoice):
+        self.replies[choice.name] = self.replies.get(choice.name, 0) + 1
+        metrics.TIER_REPLIES.inc(1, choice.name, choice.reason)
+
+    def stats(self) -> Dict:
+        stats = {}
+        for name, tier in self.tiers.items():
+            p95 = tier.p95()
+            stats[name] = {"model": tier.model, "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+                           "replies": self.replies.get(name, 0)}
+        return stats
+
+_clients: "weakref.WeakSet[OllamaClient]" = weakref.WeakSet()
+
+def _backend_samples(field: str):
+    return [((backend.url,), float(backend.stats()[field])) for client in list(_clients) for backend in client.backends]
+
+metrics.Gauge("lycoris_ollama_backend_up", "1 while the backend's circuit is closed",
+              lambda: _backend_samples("up"), ("backend",))
+metrics.Gauge("lycoris_ollama_backend_outstanding", "Requests in flight per backend",
+              lambda: _backend_samples("outstanding"), ("backend",))
+
+def _tier_p95():
+    samples = []
+    for client in list(_clients):
+        for tier in client.tiers.tiers.values():
+            p95 = tier.p95()
+            if p95 is not None:
+                samples.append(((tier.name,), p95))
+    return samples
+
+metrics.Gauge("lycoris_llm_tier_p95_seconds", "p95 reply latency per model tier over LLM_TIER_WINDOW",
+              _tier_p95, ("tier",))
+
+class OllamaClient:
+    """Long-lived client over one or more Ollama nodes: pooled keep-alive connections, a cap on
+    in-flight generations, model tiers, least-outstanding routing with model affinity and failover"""
+
+    def __init__(self, urls: Union[str, Sequence[str]] = OLLAMA_URLS, max_inflight: int = LLM_MAX_INFLIGHT,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, probe_interval: float = LLM_PROBE_INTERVAL,
+                 keep_alive: Optional[str] = LLM_KEEP_ALIVE, idle_release: float = LLM_IDLE_RELEASE,
+                 tiers: Optional[TierRouter] = None):
+        if isinstance(urls, str):
+            urls = [url.strip() for url in urls.split(",") if url.strip()]
+        if not urls:
+            raise ValueError("no Ollama URL configured (OLLAMA_URL or OLLAMA_URLS)")
+        self.backends = [Backend(url) for url in urls]
+        self.queue_timeout = queue_timeout
+        self.probe_interval = probe_interval
+        # max_inflight is per node (in cluster mode, this worker's share of LLM_MAX_INFLIGHT, see main.py)
+        self.max_inflight = max_inflight * len(self.backends)
+        self._slots = FairQueue(self.max_inflight)
+        self._prober: Optional[asyncio.Task] = None
+        self.tiers = tiers or TierRouter()
+        # Model residency (see warmup/release) and startup timing
+        self.keep_alive = keep_alive
+        self.idle_release = idle_release
+        self.last_used = time.monotonic()
+        self.resident = False
+        self._idler: Optional[asyncio.Task] = None
+        self.created = time.monotonic()
+        self.ready_at: Optional[float] = None
+        self.first_reply: Optional[float] = None
+        # Low-priority requests in flight (see background_chat), and the ones cancelled to make room
+        self._background: Set[asyncio.Task] = set()
+        self._preempted: Set[asyncio.Task] = set()
+        _clients.add(self)
+
+    async def open(self):
+        for backend in self.backends:
+            if backend.http is None:
+                backend.http = httpx.AsyncClient(
+                    base_url=backend.url,
+                    timeout=httpx.Timeout(LLM_TIMEOUT, connect=5),
+                    limits=httpx.Limits(
+                        max_connections=LLM_POOL_CONNECTIONS,
+                        max_keepalive_connections=LLM_POOL_CONNECTIONS,
+                        keepalive_expiry=LLM_POOL_KEEPALIVE,
+                    ),
+                )
+        if self._prober is None and self.probe_interval > 0:
+            self._prober = asyncio.create_task(self._probe_loop())
+        if self._idler is None and self.idle_release > 0:
+            self._idler = asyncio.create_task(self._idle_loop())
+
+    async def close(self):
+        for task in (self._prober, self._idler):
+            if task is not None:
+                task.cancel()
+        self._prober = self._idler = None
+        for backend in self.backends:
+            if backend.http is not None:
+                await backend.http.aclose()
+                backend.http = None
+
+    @property
+    def waiting(self) -> int:
+        return self._slots.waiting
+
+    @property
+    def inflight(self) -> int:
+        return self._slots.busy
+
+    def stats(self) -> List[Dict]:
+        return [backend.stats() for backend in self.backends]
+
+    def choose_tier(self, requested: str, prompt_tokens: int) -> TierChoice:
+        """Tier for a request of about `prompt_tokens`, given how many requests queue right now"""
+        return self.tiers.choose(requested, prompt_tokens, self._slots.waiting)
+
+    def _tier(self, choice: Optional[TierChoice]) -> TierChoice:
+        return choice or TierChoice(self.tiers[LARGE], "default")
+
+    @contextlib.asynccontextmanager
+    async def slot(self, flows: Flow = (), background: bool = False):
+        """Wait (up to queue_timeout) for a generation slot, fairly shared between flows"""
+        if not background and self._background and self._slots.busy >= self._slots.capacity:
+            self._preempt()
+        begin = time.perf_counter()
+        try:
+            await self._slots.acquire(flows, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise QueueTimeout(f"no Ollama slot after {self.queue_timeout}s") from None
+        finally:
+            metrics.QUEUE_WAIT.observe(time.perf_counter() - begin)
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    # --- Routing
+    def pick(self, model: str, exclude: Iterable[Backend] = (), prefer: Optional[str] = None) -> Optional[Backend]:
+        """Node with the least outstanding work among those whose circuit lets requests through,
+        preferring the ones known to serve `model` (and the `prefer` node above all, when it does)"""
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b not in exclude and b.http is not None and b.available(now)]
+        serving = [b for b in candidates if b.serves(model)]
+        if not candidates:
+            return None
+        for backend in serving:
+            if backend.url == prefer:
+                return backend
+        return min(serving or candidates, key=Backend.rank)
+
+    def _route(self, model: str, tried: List[Backend], last_error: Optional[Exception],
+               prefer: Optional[str] = None) -> Backend:
+        backend = self.pick(model, tried, prefer)
+        if backend is None:
+            raise last_error or httpx.ConnectError("no Ollama backend available")
+        if tried:
+            logging.info(f"Lycoris::LLM::Retrying on {backend.url} ({last_error!r} from {tried[-1].url})")
+        tried.append(backend)
+        return backend
+
+    # --- Probes
+    async def probe(self, backend: Backend) -> bool:
+        """Refresh the models a node serves. Answering /api/tags doesn't prove it can generate
+        (a busy node still does), so only a successful generation closes its circuit."""
+        try:
+            response = await backend.http.get("/api/tags", timeout=10)
+            response.raise_for_status()
+            backend.models = {model.get("name") or model.get("model") for model in response.json().get("models", [])}
+        except Exception as error:
+            backend.reachable = False
+            if backend.failures < LLM_BREAKER_FAILURES:
+                backend.failed(error)
+            return False
+        backend.reachable = True
+        return True
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            await asyncio.gather(*(self.probe(backend) for backend in self.backends))
+
+    async def healthcheck(self):
+        """Log whether each Ollama node answers and has the tier models"""
+        results = await asyncio.gather(*(self.probe(backend) for backend in self.backends))
+        for backend, ok in zip(self.backends, results):
+            if not ok:
+                logging.error(f"Lycoris::LLM::No response from Ollama at {backend.url}")
+                continue
+            missing = [model for model in self.tiers.models() if not backend.serves(model)]
+            for model in missing:
+                logging.warning(f"Lycoris::LLM::Can't found '{model}' Ollama model on {backend.url}. "
+                                f"`ollama pull {model}`")
+            if not missing:
+                logging.info(f"Lycoris::LLM::Ollama OK at {backend.url} — models: {', '.join(self.tiers.models())}")
+
+    # --- Model residency
+    async def _load(self, backend: Backend, model: str, keep_alive) -> bool:
+        """Zero-token /api/generate: loads the model (or unloads it with keep_alive=0)"""
+        payload = {"model": model, "prompt": "", "stream": False}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        try:
+            response = await backend.http.post("/api/generate", json=payload)
+            response.raise_for_status()
+            return True
+        except Exception as error:
+            logging.warning(f"Lycoris::LLM::Can't {'unload' if keep_alive == 0 else 'load'} {model} on {backend.url}: {error!r}")
+            return False
+
+    async def warmup(self, model: Optional[str] = None):
+        """Load the model (every tier's by default) on every node that can serve it, so the first
+        message doesn't pay for it"""
+        if model is None:
+            await asyncio.gather(*(self.warmup(model) for model in self.tiers.models()))
+            return
+        begin = time.perf_counter()
+        nodes = [b for b in self.backends if b.http is not None and b.serves(model)]
+        results = await asyncio.gather(*(self._load(b, model, self.keep_alive) for b in nodes))
+        if any(results):
+            self.resident = True
+            self.last_used = time.monotonic()
+        logging.info(f"Lycoris::LLM::{model} warmed up on {sum(results)}/{len(nodes)} nodes "
+                     f"in {time.perf_counter() - begin:.2f}s")
+
+    async def release(self):
+        """Let Ollama unload the tier models now instead of holding them through a quiet period"""
+        nodes = [b for b in self.backends if b.http is not None and b.available(time.monotonic())]
+        models = self.tiers.models()
+        await asyncio.gather(*(self._load(b, model, 0) for b in nodes for model in models))
+        self.resident = False
+        logging.info(f"Lycoris::LLM::No traffic for {self.idle_release:.0f}s, {', '.join(models)} released")
+
+    async def _idle_loop(self):
+        while True:
+            await asyncio.sleep(min(self.idle_release / 4, 60))
+            if self.resident and time.monotonic() - self.last_used >= self.idle_release and not self.inflight:
+                await self.release()
+
+    def _used(self, payload: Dict):
+        """A request is going out: it keeps (or makes) the model resident"""
+        self.last_used = time.monotonic()
+        self.resident = True
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+
+    def mark_ready(self):
+        if self.ready_at is None:
+            self.ready_at = time.monotonic()
+
+    def _replied(self):
+        if self.first_reply is not None:
+            return
+        self.first_reply = now = time.monotonic()
+        since_ready = f", {now - self.ready_at:.2f}s after ready" if self.ready_at is not None else ""
+        logging.info(f"Lycoris::LLM::First reply {now - self.created:.2f}s after startup{since_ready}")
+
+    # --- Background work
+    async def background_chat(self, messages: List[Dict[str, str]], stats: Optional[Dict] = None) -> str:
+        """Low-priority chat(): it only starts while a slot is free and nobody queues, and
+        raises Preempted as soon as an interactive request has to wait for its slot"""
+        while self._slots.waiting or self._slots.busy >= self._slots.capacity:
+            await asyncio.sleep(BACKGROUND_POLL)
+        inner = asyncio.create_task(self.chat(messages, BACKGROUND_FLOWS, stats, background=True))
+        self._background.add(inner)
+        try:
+            return await inner
+        except asyncio.CancelledError:
+            if inner not in self._preempted:
+                raise
+            raise Preempted("gave way to interactive requests") from None
+        finally:
+            self._background.discard(inner)
+            self._preempted.discard(inner)
+
+    def _preempt(self):
+        for task in self._background:
+            if not task.done():
+                self._preempted.add(task)
+                task.cancel()
+
+    # --- Generation
+    async def chat(self, messages: List[Dict[str, str]], flows: Flow = (), stats: Optional[Dict] = None,
+                   background: bool = False, tier: Optional[TierChoice] = None) -> str:
+        """Send a chat request and return text content, raising on any failure.
+        Ollama's token and timing counters, and the tier that answered, are copied into
+        `stats` when given. Without a `tier` (see choose_tier), the large model answers."""
+        tier = self._tier(tier)
+        payload = {
+            "model": tier.model,
+            "messages": messages,
+            "stream": False,
+            "options": {"temperature": TEMPERATURE},
+        }
+        data = await self._complete("/api/chat", payload, "chat", flows, stats, tier, background)
+        message = data.get("message") or {}
+        content = (message.get("content") or "").strip()
+        return content or EMPTY_REPLY
+
+    async def generate(self, prompt: str, flows: Flow = (), stats: Optional[Dict] = None, system: Optional[str] = None,
+                       context: Optional[List[int]] = None, prefer: Optional[str] = None,
+                       tier: Optional[TierChoice] = None) -> str:
+        """One /api/generate turn. With the `context` Ollama returned for the previous turn, only
+        `prompt` is evaluated; the new context is copied into stats["context"] and the node that
+        answered into stats["backend"] (pass it back as `prefer`: its KV cache holds that context).
+        A context only makes sense to the model that produced it: keep the same tier model."""
+        tier = self._tier(tier)
+        payload = self._generate_payload(tier.model, prompt, system, context, stream=False)
+        data = await self._complete("/api/generate", payload, "generate", flows, stats, tier, prefer=prefer)
+        return (data.get("response") or "").strip() or EMPTY_REPLY
+
+    @staticmethod
+    def _generate_payload(model: str, prompt: str, system: Optional[str], context: Optional[List[int]],
+                          stream: bool) -> Dict:
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {"temperature": TEMPERATURE},
+        }
+        if system:
+            payload["system"] = system
+        if context:
+            payload["context"] = context
+        return payload
+
+    async def _complete(self, path: str, payload: Dict, mode: str, flows: Flow, stats: Optional[Dict],
+                        tier: TierChoice, background: bool = False, prefer: Optional[str] = None) -> Dict:
+        self._used(payload)
+        async with self.slot(flows, background):
+            begin = time.perf_counter()
+            data, backend = await self._post(path, payload, mode, prefer)
+            latency = time.perf_counter() - begin
+        self._finished(data, backend, stats, tier, latency, background)
+        return data
+
+    def _finished(self, data: Dict, backend: Backend, stats: Optional[Dict], tier: TierChoice, latency: float,
+                  background: bool = False):
+        metrics.record_generation(data)
+        # Idle-time work (summaries) neither counts as a reply nor weighs on the tier's p95
+        if not background:
+            self._replied()
+            tier.tier.observe(latency)
+            self.tiers.replied(tier)
+        if stats is not None:
+            stats.update((key, data[key]) for key in STAT_KEYS if key in data)
+            stats["backend"] = backend.url
+            stats["tier"] = tier.name
+            stats["model"] = tier.model
+            if "context" in data:
+                stats["context"] = data["context"]
+
+    async def _post(self, path: str, payload: Dict, mode: str, prefer: Optional[str] = None) -> Tuple[Dict, Backend]:
+        """POST to the best node, moving to another one on connect errors and timeouts"""
+        tried: List[Backend] = []
+        error: Optional[Exception] = None
+        while True:
+            backend = self._route(payload["model"], tried, error, prefer)
+            backend.outstanding += 1
+            backend.requests += 1
+            begin = time.perf_counter()
+            try:
+                response = await backend.http.post(path, json=payload)
+                response.raise_for_status()
+            except RETRYABLE as retryable:
+                backend.failed(retryable)
+                error = retryable
+                continue
+            except httpx.HTTPStatusError as status:
+                if status.response.status_code >= 500:
+                    backend.failed(status)
+                raise
+            finally:
+                backend.outstanding -= 1
+            latency = time.perf_counter() - begin
+            backend.succeeded(latency)
+            metrics.OLLAMA_LATENCY.observe(latency, mode, backend.url)
+            return response.json(), backend
+
+    def stream(self, messages: List[Dict[str, str]], flows: Flow = (), stats: Optional[Dict] = None,
+               tier: Optional[TierChoice] = None) -> AsyncIterator[str]:
+        """Send a streaming chat request and yield content deltas as Ollama produces them"""
+        tier = self._tier(tier)
+        payload = {
+            "model": tier.model,
+            "messages": messages,
+            "stream": True,
+            "options": {"temperature": TEMPERATURE},
+        }
+        return self._stream("/api/chat", payload, flows, stats, tier)
+
+    def stream_generate(self, prompt: str, flows: Flow = (), stats: Optional[Dict] = None, system: Optional[str] = None,
+                        context: Optional[List[int]] = None, prefer: Optional[str] = None,
+                        tier: Optional[TierChoice] = None) -> AsyncIterator[str]:
+        """generate(), streamed"""
+        tier = self._tier(tier)
+        payload = self._generate_payload(tier.model, prompt, system, context, stream=True)
+        return self._stream("/api/generate", payload, flows, stats, tier, prefer)
+
+    async def _stream(self, path: str, payload: Dict, flows: Flow, stats: Optional[Dict], tier: TierChoice,
+                      prefer: Optional[str] = None, background: bool = False) -> AsyncIterator[str]:
+        """Yield content deltas as Ollama produces them. Only a request that produced nothing
+        yet is moved to another node."""
+        self._used(payload)
+        tried: List[Backend] = []
+        error: Optional[Exception] = None
+        async with self.slot(flows, background):
+            while True:
+                backend = self._route(payload["model"], tried, error, prefer)
+                backend.outstanding += 1
+                backend.requests += 1
+                begin = time.perf_counter()
+                started = False
+                try:
+                    async with backend.http.stream("POST", path, json=payload) as response:
+                        if response.is_error:
+                            await response.aread()
+                            response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line:
+                                continue
+                            data = json.loads(line)
+                            if data.get("error"):
+                                raise RuntimeError(data["error"])
+                            delta = (data.get("message") or {}).get("content") or data.get("response") or ""
+                            if delta:
+                                started = True
+                                yield delta
+                            if data.get("done"):
+                                self._finished(data, backend, stats, tier, time.perf_counter() - begin, background)
+                                break
+                except RETRYABLE as retryable:
+                    backend.failed(retryable)
+                    if started:
+                        raise
+                    error = retryable
+                    continue
+                except httpx.HTTPStatusError as status:
+                    if status.response.status_code >= 500:
+                        backend.failed(status)
+                    raise
+                finally:
+                    backend.outstanding -= 1
+                latency = time.perf_counter() - begin
+                backend.succeeded(latency)
+                metrics.OLLAMA_LATENCY.observe(latency, "stream", backend.url)
+                return
+
+    async def reply(self, messages: List[Dict[str, str]], flows: Flow = (), stats: Optional[Dict] = None,
+                    tier: Optional[TierChoice] = None) -> str:
+        """Like chat(), but errors come back as user-facing text"""
+        try:
+            return await self.chat(messages, flows, stats, tier=tier)
+        except Exception as error:
+            return describe_error(error)
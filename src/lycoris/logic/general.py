@@ -1,14 +1,19 @@
-import re
+import asyncio
 import discord
 from discord.ext import commands
-from ..config import CREATE_RE, COUNT_RE
-from ..utils import is_general_channel, split_discord, channel_link
+from typing import Dict
+from ..utils import channel_link
 from ..instances import create_instance
-from ..state import user_instances
-from ..llm import reply as llm_reply
-from ..config import DEFAULT_SYSTEM, COUNT_RE, CREATE_RE, PRIVATE_WORDS, PLACE_WORDS, CREATE_VERBS
-
-PURGE_RE = re.compile(r"\b(purge|vider|effacer|clear|wipe)\b", re.I)
+from ..streaming import StreamingMessage
+from ..cache import ResponseCache, SingleFlight, cache_key
+from ..llm import describe_error, EMPTY_REPLY, FAST
+from ..context import estimate_tokens
+from ..scheduler import flows_for
+from ..state import registry
+from ..intents import classify, PURGE, COUNT, CREATE, CANCEL
+from ..purge import PurgeJob
+from ..metrics import span
+from ..config import DEFAULT_SYSTEM, LLM_STREAM
 
 def build_messages_for_general(user_prompt: str):
     personality = (
@@ -25,72 +30,83 @@ def build_messages_for_general(user_prompt: str):
 
 def want_instance(text: str) -> bool:
     """Detect whether the user asks for a private instance in general"""
-    text = text.lower()
-    if CREATE_RE.search(text):
-        return True
-    if any(word in text for word in PRIVATE_WORDS) and any(place in text for place in PLACE_WORDS):
-        return True
-    if any(verb in text for verb in CREATE_VERBS) and any(word in text for word in PRIVATE_WORDS):
-        return True
-    return False
+    return CREATE in classify(text)
 
 class GeneralLogic(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.cache = ResponseCache()
+        self.inflight = SingleFlight()
+        self._purges: Dict[int, asyncio.Task] = {}  # channel.id -> running purge
     
-    async def _purge_channel(self, channel: discord.TextChannel) -> int:
-        """Delete all non-pinned messages"""
-        def _keep(msg: discord.Message) -> bool:
-            return not msg.pinned
-        deleted_total = 0
-        while True:
-            batch = await channel.purge(limit=50, check=_keep, bulk=False)
-            deleted_total += len(batch)
-            if len(batch) == 0:
-                break
-        return deleted_total
+    @staticmethod
+    def _can_manage(message: discord.Message) -> bool:
+        perms = message.channel.permissions_for(message.author)
+        return perms.manage_messages or message.author.guild_permissions.administrator
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot or not isinstance(message.channel, discord.TextChannel):
-            return
-        if not is_general_channel(message.channel):
-            return
-
-        # Only answer when mention
-        me = self.bot.user
-        if not (me and me in message.mentions):
-            return
+    async def _purge_channel(self, channel: discord.TextChannel, progress: discord.Message) -> PurgeJob:
+        """Delete all non-pinned messages, reporting in `progress`; cancellable via _purges"""
+        job = PurgeJob(channel, progress)
+        task = asyncio.create_task(job.run())
+        self._purges[channel.id] = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                # This handler is being cancelled, not the purge itself
+                task.cancel()
+                raise
+        finally:
+            self._purges.pop(channel.id, None)
+        return job
 
+    async def handle(self, message: discord.Message):
+        """A message mentioning Lycoris in the general channel (see logic.router)"""
         content_clean = message.content
         if message.guild and message.guild.me:
             content_clean = content_clean.replace(message.guild.me.mention, "").strip()
-        content_norm = content_clean.lower()
+        with span("general", "intent"):
+            intents = classify(content_clean)
         
+        # 0. Stop a running purge (same permissions as starting one)
+        if CANCEL in intents and message.channel.id in self._purges:
+            if self._can_manage(message):
+                self._purges[message.channel.id].cancel()
+            return
+
         # 1. Purge command (restricted to users with Manage Messages OR Admin)
-        if PURGE_RE.search(content_norm):
-            perms = message.channel.permissions_for(message.author)
-            if not (perms.manage_messages or message.author.guild_permissions.administrator):
+        if PURGE in intents:
+            if not self._can_manage(message):
                 await message.channel.send("Je n'ai pas le droit de nettoyer ce salon (permission *Gérer les messages* requise)")
                 return
             my_perms = message.channel.permissions_for(message.guild.me)
             if not my_perms.manage_messages:
                 await message.channel.send("Je n'ai pas la permission *Gérer les messages* ici")
                 return
-            await message.channel.send("Nettoyage en cours...")
-            deleted = await self._purge_channel(message.channel)
-            await message.channel.send("J'ai finit de nettoyé le salon")
+            if message.channel.id in self._purges:
+                await message.channel.send("Un nettoyage est déjà en cours (dis `@Lycoris stop` pour l'arrêter).")
+                return
+            progress = await message.channel.send("Nettoyage en cours...")
+            job = await self._purge_channel(message.channel, progress)
+            if job.finished:
+                text = f"J'ai fini de nettoyer le salon ({job.deleted} messages supprimés)."
+            else:
+                text = f"Nettoyage interrompu : {job.deleted} messages supprimés."
+            try:
+                await progress.edit(content=text)
+            except discord.HTTPException:
+                await message.channel.send(text)
             return
 
         # 2. Count instances
-        if COUNT_RE.search(content_norm) or (re.search(r"\binstances?\b", content_norm) and re.search(r"\b(combien|nombre|compte)\b", content_norm)):
-            total = sum(len(v) for v in user_instances.values())
-            await message.channel.send(f"Instances actives: **{total}**.")
+        if COUNT in intents:
+            total = registry.guild_count(message.guild.id)
+            self.bot.delivery.send(message.channel, f"Instances actives: **{total}**.")
             return
 
         # 3. Create new instance
-        if want_instance(content_norm):
-            if len(user_instances[message.author.id]) >= 2:
+        if CREATE in intents:
+            if registry.count_for(message.guild.id, message.author.id) >= 2:
                 await message.channel.send(
                     f"Désolée {message.author.mention}, tu as déjà 2 instances actives. "
                     "Ferme-en une (dis 'au revoir' dans l’instance) avant d’en créer une autre."
@@ -108,13 +124,45 @@ class GeneralLogic(commands.Cog):
                     await message.channel.send("Je ne peux pas créer d’instance maintenant.")
             return
 
-        # Else -> Neutral answer
-        async with message.channel.typing():
-            try:
-                messages = build_messages_for_general(content_clean)
-                text = await llm_reply(messages)
-            except Exception as error:
-                text = f"Erreur IA : {error}"
+        # Else -> Neutral answer (stateless, so identical prompts share one answer)
+        await self._neutral_answer(message, content_clean)
+
+    async def _neutral_answer(self, message: discord.Message, prompt: str):
+        channel = message.channel
+        messages = build_messages_for_general(prompt)
+        flows = flows_for(message)
+        tier = self.bot.llm.choose_tier(FAST, estimate_tokens(prompt))
+        key = cache_key(prompt, messages[0]["content"], tier.model)
+
+        text = self.cache.get(key)
+        if text is not None:
+            with span("general", "deliver"):
+                self.bot.delivery.send(channel, text)
+            return
+
+        out = StreamingMessage(channel) if LLM_STREAM else None
 
-        for chunk in split_discord(text):
-            await message.channel.send(chunk)
+        async def produce() -> str:
+            async with channel.typing():
+                if out is None:
+                    return await self.bot.llm.chat(messages, flows, tier=tier)
+                await out.consume(self.bot.llm.stream(messages, flows, tier=tier))
+            return await out.finish()
+
+        leader = key not in self.inflight
+        try:
+            with span("general", "generate"):
+                text = await self.inflight.do(key, produce)
+            # An empty generation isn't an answer worth repeating for the whole TTL
+            if text != EMPTY_REPLY:
+                self.cache.put(key, text)
+        except Exception as error:
+            if out is not None and leader:
+                await out.fail(error)
+                return
+            text = describe_error(error)
+
+        if out is not None and leader:
+            return
+        with span("general", "deliver"):
+            self.bot.delivery.send(channel, text)
@@ -3,75 +3,108 @@ import logging
 import discord
 from discord.ext import commands
 
-from ..state import instance_owner, memory, personas, instance_tags, facts, is_instance_channel_id
-from ..config import PERSONALITY_TAGS, DEFAULT_SYSTEM
-from ..llm import reply as llm_reply
-from ..utils import split_discord
+from ..state import InstanceRecord, registry, ensure_loaded
+from ..config import PERSONALITY_TAGS, LLM_STREAM, LLM_KV_CONTEXT
+from ..context import build_instance_prompt, history_entry, record_usage
+from ..kvcontext import GenerateRequest, sessions
+from ..llm import describe_error, LARGE, TierChoice
+from ..streaming import stream_reply
+from ..scheduler import ChannelScheduler, flows_for
+from ..metrics import span
+from ..resident import residents
 from ..instances import close_instance
-
-GOODBYE_RE = re.compile(r"\b(au\s*revoir|aurevoir|bye|à\s*plus|ciao)\b", re.I)
-
-def facts_block(channel_id: int) -> str:
-    if not facts[channel_id]:
-        return ""
-    lst = facts[channel_id][-10:]
-    return "Faits pour cette instance:\n" + "\n".join(f"- {f}" for f in lst)
-
-def build_messages_for_instance(channel_id: int, user_prompt: str):
-    base = personas[channel_id] or DEFAULT_SYSTEM
-    tags = instance_tags.get(channel_id, [])
-    if tags:
-        mapped = [PERSONALITY_TAGS[tag] for tag in tags if tag in PERSONALITY_TAGS]
-        if mapped:
-            tags_txt = "\nPersonnalité: " + " ".join(mapped)
-    messages = [{"role": "system", "content": base}]
-    facts = facts_block(channel_id)
-    if facts:
-        messages.append({"role": "system", "content": facts})
-    messages.extend(list(memory[channel_id]))
-    messages.append({"role": "user", "content": user_prompt})
-    return messages
+from ..pool import pool
+from ..intents import classify, GOODBYE, TAGS
 
 class InstanceChatLogic(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.scheduler = ChannelScheduler()
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot or not isinstance(message.channel, discord.TextChannel):
-            return
-
-        # Only respond in instance channels and only to the owner
-        owner_id = instance_owner.get(message.channel.id)
-        if owner_id and message.author.id != owner_id:
-            return
+    async def handle(self, message: discord.Message, record: InstanceRecord):
+        """A message from the owner of an instance channel (see logic.router)"""
+        # The conversation goes on: don't summarize it under its feet
+        self.bot.compactor.cancel(record.channel_id)
+        with span("instance", "intent"):
+            intents = classify(message.content)
 
         # Close instance
-        if GOODBYE_RE.search(message.content):
+        if GOODBYE in intents:
+            self.scheduler.cancel(message.channel.id)
             await close_instance(message.channel, reason="Instance fermée. À bientôt !")
             return
 
         # Personality tags (e.g. "@Lycoris tags: joyeuse, sarcasme")
         me = self.bot.user
-        if me and me in message.mentions:
-            message = re.search(r"tags?\s*:\s*(.+)$", message.content, re.I)
-            if message:
-                tags = [t.strip().lower() for t in re.split(r"[,\|;/]", message.group(1))]
-                ok = [t for t in tags if t in PERSONALITY_TAGS]
-                instance_tags[message.channel_id] = ok
-                txt = ", ".join(ok) if ok else "aucun"
-                await message.channel.send(f"Tags appliqués: {txt}.")
-                return
+        if me and me in message.mentions and TAGS in intents:
+            tags = [t.strip().lower() for t in re.split(r"[,\|;/]", intents.tags)]
+            ok = [t for t in tags if t in PERSONALITY_TAGS]
+            if record.channel_id in registry:
+                registry.set_tags(record.channel_id, ok)
+            txt = ", ".join(ok) if ok else "aucun"
+            self.bot.delivery.send(message.channel, f"Tags appliqués: {txt}.")
+            return
+
+        # Chat with memory: bursts are merged into one turn, stale generations cancelled
+        channel = message.channel
+        flows = flows_for(message)
+
+        async def generate(turn: str) -> str:
+            with span("instance", "prompt"):
+                await ensure_loaded(channel.id)
+                residents.note(channel.id)
+                build = build_instance_prompt(channel.id, turn)
+                tier = self.bot.llm.choose_tier(LARGE, build.tokens)
+                request = sessions.request(record, build, tier.model) if LLM_KV_CONTEXT else None
+            stats = {}
+            with span("instance", "generate"):
+                if request is not None:
+                    text = await self._generate(channel, request, flows, stats, tier)
+                elif LLM_STREAM:
+                    text = await stream_reply(channel, self.bot.llm.stream(build.messages, flows, stats, tier))
+                else:
+                    async with channel.typing():
+                        text = await self.bot.llm.reply(build.messages, flows, stats, tier)
+            used = record_usage(channel.id, build, stats)
+            details = f", {tier.name} tier ({tier.reason})"
+            if request is not None:
+                saved = sessions.finished(channel.id, request, stats)
+                details += f", context {'reused' if request.reused else 'rebuilt'}"
+                if saved is not None:
+                    details += f" (~{saved * 1000:.0f} ms of prompt evaluation saved)"
+            logging.info(f"Lycoris::Instance::{channel.id} prompt ~{used['estimated']} tokens "
+                         f"({used['history_turns']} turns), Ollama evaluated {used['prompt_eval_count']}{details}")
+            return text
+
+        async def deliver(turn: str, text: str):
+            record = registry.get(channel.id)
+            if record is not None:
+                # Its memory may have been evicted while the reply was generated
+                await ensure_loaded(channel.id)
+                record.history.append(history_entry("user", turn))
+                record.history.append(history_entry("assistant", text))
+                if LLM_KV_CONTEXT:
+                    sessions.commit(channel.id, record.history[-1])
+                residents.note(channel.id)
+                self.bot.compactor.schedule(channel.id)
+            if not LLM_STREAM:
+                with span("instance", "deliver"):
+                    self.bot.delivery.send(channel, text)
 
-        # Chat with memory
-        async with message.channel.typing():
-            messages = build_messages_for_instance(message.channel.id, message.content.strip())
-            text = await llm_reply(messages)
-            memory[message.channel.id].append({"role": "user", "content": message.content.strip()})
-            memory[message.channel.id].append({"role": "assistant", "content": text})
+        self.scheduler.submit(channel.id, message.content.strip(), generate, deliver)
 
-        for chunk in split_discord(text):
-            await message.channel.send(chunk)
+    async def _generate(self, channel: discord.TextChannel, request: GenerateRequest, flows, stats,
+                        tier: TierChoice) -> str:
+        """Instance turn on /api/generate, on top of the channel's previous context when it has one"""
+        llm = self.bot.llm
+        args = (request.prompt, flows, stats, request.system, request.context, request.prefer, tier)
+        if LLM_STREAM:
+            return await stream_reply(channel, llm.stream_generate(*args))
+        async with channel.typing():
+            try:
+                return await llm.generate(*args)
+            except Exception as error:
+                return describe_error(error)
 
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
@@ -79,14 +112,12 @@ class InstanceChatLogic(commands.Cog):
         if not isinstance(channel, discord.TextChannel):
             return
         cid = channel.id
-        if is_instance_channel_id(cid):
+        # Replies still queued for this channel have nowhere to go
+        self.bot.delivery.drop(cid)
+        pool.discard(cid)
+        if cid in registry:
             # If manual clean wasn't done, clean Lyrocis data
-            from ..state import user_instances
-            uid = instance_owner.pop(cid, None)
-            if uid:
-                user_instances[uid] = [c for c in user_instances[uid] if c != cid]
-            memory.pop(cid, None)
-            facts.pop(cid, None)
-            personas.pop(cid, None)
-            instance_tags.pop(cid, None)
+            self.scheduler.cancel(cid)
+            self.bot.compactor.cancel(cid)
+            registry.remove(cid)
             logging.info(f"Instance {cid} supprimée manuellement, état nettoyé.")
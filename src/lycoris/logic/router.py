@@ -0,0 +1,85 @@
+import discord
+from discord.ext import commands
+from typing import Dict, Tuple
+
+from ..state import registry
+from ..utils import is_general_channel
+from ..metrics import ROUTED, ROUTER_DROPS
+from .general import GeneralLogic
+from .instance_chat import InstanceChatLogic
+
+# Channel classes
+GENERAL = "general"
+INSTANCE = "instance"
+IGNORED = "ignored"
+
+class Router(commands.Cog):
+    """The only on_message listener: classifies the channel once, drops what no handler
+    wants before any parsing, and hands the rest to the general or the instance handler."""
+
+    def __init__(self, bot: commands.Bot, general: GeneralLogic, instances: InstanceChatLogic):
+        self.bot = bot
+        self.general = general
+        self.instances = instances
+        self._classes: Dict[int, str] = {}   # channel.id -> GENERAL / IGNORED (instances live in the registry)
+        self.seen = 0
+        self.dropped: Dict[Tuple[str, str], int] = {}
+
+    def channel_class(self, channel: discord.TextChannel) -> str:
+        if channel.id in registry:
+            return INSTANCE
+        kind = self._classes.get(channel.id)
+        if kind is None:
+            kind = self._classes[channel.id] = GENERAL if is_general_channel(channel) else IGNORED
+        return kind
+
+    def _drop(self, kind: str, reason: str):
+        key = (kind, reason)
+        self.dropped[key] = self.dropped.get(key, 0) + 1
+        ROUTER_DROPS.inc(1, kind, reason)
+
+    def drops_by_class(self) -> Dict[str, int]:
+        totals: Dict[str, int] = {}
+        for (kind, _), count in self.dropped.items():
+            totals[kind] = totals.get(kind, 0) + count
+        return totals
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        self.seen += 1
+        channel = message.channel
+        if not isinstance(channel, discord.TextChannel):
+            self._drop(IGNORED, "not_text")
+            return
+        kind = self.channel_class(channel)
+        if message.author.bot:
+            self._drop(kind, "bot")
+            return
+
+        if kind == INSTANCE:
+            record = registry.get(channel.id)
+            # Only the owner talks to an instance
+            if record is None or message.author.id != record.owner_id:
+                self._drop(kind, "not_owner")
+                return
+            ROUTED.inc(1, kind)
+            await self.instances.handle(message, record)
+        elif kind == GENERAL:
+            # Only answer when mentioned
+            me = self.bot.user
+            if not (me and me in message.mentions):
+                self._drop(kind, "no_mention")
+                return
+            ROUTED.inc(1, kind)
+            await self.general.handle(message)
+        else:
+            self._drop(kind, "channel")
+
+    # A renamed channel may become (or stop being) the general one
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        self._classes.pop(after.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        self._classes.pop(channel.id, None)
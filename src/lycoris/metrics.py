@@ -0,0 +1,198 @@
+import sys
+import time
+import asyncio
+import logging
+import contextlib
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from .config import METRICS_HOST, METRICS_PORT
+from .state import registry
+
+# Nothing is recorded until serve() runs: every probe starts with this check
+ENABLED = False
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+
+_metrics: List["_Metric"] = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        _metrics.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, *labels):
+        if ENABLED:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, List] = {}   # labels -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value: float, *labels):
+        if not ENABLED:
+            return
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - begin, *labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        names = self.labels + ("le",)
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, hits in zip(self.buckets + ("+Inf",), counts):
+                cumulative += hits
+                lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+class Gauge(_Metric):
+    """Read when scraped: `collect` returns (label values, value) pairs, so it costs nothing in between"""
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, collect: Callable[[], Iterable[Tuple[Tuple, float]]],
+                 labels: Iterable[str] = ()):
+        super().__init__(name, doc, labels)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in self.collect()]
+
+# --- Hot path measurements
+QUEUE_WAIT     = Histogram("lycoris_llm_queue_wait_seconds", "Time spent waiting for an Ollama slot")
+OLLAMA_LATENCY = Histogram("lycoris_ollama_latency_seconds", "Ollama request time, slot excluded", ("mode", "backend"))
+TIER_LATENCY   = Histogram("lycoris_llm_tier_latency_seconds", "Reply time per model tier, slot excluded", ("tier",))
+TIER_REPLIES   = Counter("lycoris_llm_tier_replies_total", "Replies per model tier and routing reason", ("tier", "reason"))
+BACKEND_ERRORS = Counter("lycoris_ollama_backend_errors_total", "Failed requests per Ollama backend", ("backend", "error"))
+TOKEN_RATE     = Histogram("lycoris_ollama_tokens_per_second", "Generation speed (eval_count / eval_duration)",
+                           buckets=RATE_BUCKETS)
+TOKENS         = Counter("lycoris_ollama_tokens_total", "Tokens evaluated by Ollama", ("kind",))
+DISCORD_LATENCY = Histogram("lycoris_discord_request_seconds", "Discord REST call time", ("route",))
+STAGES         = Histogram("lycoris_stage_seconds", "Time per message handling stage", ("handler", "stage"))
+ROUTED         = Counter("lycoris_router_handled_total", "Messages handed to a handler, per channel class", ("class",))
+ROUTER_DROPS   = Counter("lycoris_router_dropped_total", "Messages dropped before any handler ran", ("class", "reason"))
+
+def _resident_bytes(record) -> int:
+    return (sum(sys.getsizeof(entry["content"]) for entry in record.history)
+            + sum(sys.getsizeof(fact) for fact in record.facts))
+
+ACTIVE_INSTANCES = Gauge("lycoris_instances_active", "Instances known to this process",
+                         lambda: [((), len(registry))])
+CHANNEL_MEMORY  = Gauge("lycoris_channel_memory_bytes", "History and facts held in RAM per instance",
+                        lambda: [((record.guild_id, record.channel_id), _resident_bytes(record)) for record in registry],
+                        ("guild", "channel"))
+
+_NO_SPAN = contextlib.nullcontext()
+
+def span(handler: str, stage: str):
+    """Time one stage of a message handler (a shared no-op context when metrics are off)"""
+    if not ENABLED:
+        return _NO_SPAN
+    return STAGES.time(handler, stage)
+
+def record_generation(stats: Dict):
+    """Tokens and tokens/sec from the counters Ollama sends with its final response"""
+    if not ENABLED:
+        return
+    evaluated = stats.get("eval_count") or 0
+    duration = stats.get("eval_duration") or 0
+    TOKENS.inc(stats.get("prompt_eval_count") or 0, "prompt")
+    TOKENS.inc(evaluated, "generated")
+    if evaluated and duration:
+        TOKEN_RATE.observe(evaluated / (duration / 1e9))
+
+def instrument_discord(http):
+    """Time every REST call of a discord.py HTTPClient, labelled by route template"""
+    request = http.request
+
+    async def timed(route, **kwargs):
+        if not ENABLED:
+            return await request(route, **kwargs)
+        begin = time.perf_counter()
+        try:
+            return await request(route, **kwargs)
+        finally:
+            DISCORD_LATENCY.observe(time.perf_counter() - begin, f"{route.method} {route.path}")
+
+    http.request = timed
+
+# --- Exposition
+def render() -> str:
+    return "\n".join(metric.render() for metric in _metrics) + "\n"
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request.split(b" ")[1] if request.count(b" ") >= 2 else b""
+        if path.split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[asyncio.AbstractServer]:
+    """Start recording and expose /metrics in Prometheus text format (port 0 keeps metrics off)"""
+    global ENABLED
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle, host, port)
+    ENABLED = True
+    logging.info(f"Lycoris::Metrics::Serving on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import discord
+from collections import deque
+from typing import Deque, Dict, Optional
+from .config import INSTANCE_CATEGORY_NAME, INSTANCE_POOL_SIZE, POOL_REFILL_DELAY
+
+# Topic of a spare channel; claiming it replaces the topic with the owner tag
+POOL_TOPIC = "lyc-pool"
+
+async def get_or_create_category(guild: discord.Guild) -> discord.CategoryChannel:
+    """Create the dedicated Lycoris category or create it if missing"""
+    category = discord.utils.get(guild.categories, name=INSTANCE_CATEGORY_NAME)
+    if category:
+        return category
+    return await guild.create_category(INSTANCE_CATEGORY_NAME, reason="Lycoris: catégorie d'instances")
+
+def is_pool_channel(channel: discord.TextChannel) -> bool:
+    return (channel.topic or "").strip() == POOL_TOPIC
+
+def hidden_overwrites(guild: discord.Guild) -> Dict:
+    return {
+        guild.default_role: discord.PermissionOverwrite(view_channel=False),
+        guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True, manage_channels=True),
+    }
+
+class ChannelPool:
+    """Spare, hidden instance channels kept ready in each guild's Lycoris category.
+
+    claim() turns one into an instance with a single edit (name, owner topic tag and
+    overwrites together) instead of creating it; the guild's pool is then refilled in the
+    background, one creation every POOL_REFILL_DELAY seconds. Rehydration hands spare
+    channels found at startup back with adopt().
+    """
+
+    def __init__(self, size: int = INSTANCE_POOL_SIZE, refill_delay: float = POOL_REFILL_DELAY):
+        self.size = size
+        self.refill_delay = refill_delay
+        self._free: Dict[int, Deque[discord.TextChannel]] = {}   # guild.id -> spare channels
+        self._refills: Dict[int, asyncio.Task] = {}
+        self.claimed = 0
+        self.missed = 0
+
+    def available(self, guild_id: int) -> int:
+        return len(self._free.get(guild_id, ()))
+
+    def adopt(self, channel: discord.TextChannel):
+        free = self._free.setdefault(channel.guild.id, deque())
+        if all(spare.id != channel.id for spare in free):
+            free.append(channel)
+
+    def discard(self, channel_id: int):
+        """A spare channel was deleted by hand"""
+        for free in self._free.values():
+            for spare in free:
+                if spare.id == channel_id:
+                    free.remove(spare)
+                    return
+
+    async def claim(self, guild: discord.Guild, user: discord.Member, name: str, topic: str,
+                    overwrites: Dict) -> Optional[discord.TextChannel]:
+        """Hand a spare channel over to `user`, or None when the guild has none left"""
+        free = self._free.get(guild.id)
+        try:
+            while free:
+                channel = free.popleft()
+                if guild.get_channel(channel.id) is None:
+                    continue
+                try:
+                    edited = await channel.edit(name=name, topic=topic, overwrites=overwrites,
+                                                reason=f"Lycoris: instance privée pour {user}")
+                except discord.NotFound:
+                    continue
+                except discord.HTTPException as error:
+                    logging.warning(f"Lycoris::Pool::Can't claim {channel} in {guild}: {error}")
+                    return None
+                self.claimed += 1
+                return edited or channel
+            self.missed += 1
+            return None
+        finally:
+            self.refill(guild)
+
+    def refill(self, guild: discord.Guild):
+        """Top the guild's pool up in the background (no-op while a refill is running)"""
+        if self.size <= 0 or self.available(guild.id) >= self.size:
+            return
+        task = self._refills.get(guild.id)
+        if task is None or task.done():
+            self._refills[guild.id] = asyncio.create_task(self._refill(guild))
+
+    async def _refill(self, guild: discord.Guild):
+        try:
+            while self.available(guild.id) < self.size:
+                category = await get_or_create_category(guild)
+                channel = await guild.create_text_channel(
+                    f"lycoris-pool-{len(category.text_channels) + 1}", category=category,
+                    overwrites=hidden_overwrites(guild), topic=POOL_TOPIC,
+                    reason="Lycoris: salon d'instance en réserve",
+                )
+                self.adopt(channel)
+                await asyncio.sleep(self.refill_delay)
+        except discord.Forbidden:
+            logging.info(f"Lycoris::Pool::Can't create spare channels in {guild} (missing perms)")
+        except discord.HTTPException as error:
+            logging.warning(f"Lycoris::Pool::Refill failed in {guild}: {error}")
+        finally:
+            if self._refills.get(guild.id) is asyncio.current_task():
+                del self._refills[guild.id]
+
+    async def close(self):
+        tasks = list(self._refills.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+pool = ChannelPool()
@@ -0,0 +1,85 @@
+import time
+import logging
+import discord
+from datetime import timedelta
+from typing import List, Optional
+from .config import PURGE_OLD_INTERVAL, PURGE_PROGRESS_INTERVAL
+from .utils import Pacer
+
+# Discord only bulk-deletes messages younger than 14 days; keep a margin for slow runs
+BULK_MAX_AGE = timedelta(days=14) - timedelta(hours=1)
+BULK_SIZE = 100
+
+class PurgeJob:
+    """Delete every non-pinned message of a channel: one pass over history, bulk deletes
+    (100 at a time) for recent messages and paced single deletes for older ones"""
+
+    def __init__(self, channel: discord.TextChannel, progress: Optional[discord.Message] = None):
+        self.channel = channel
+        self.progress = progress
+        self.deleted = 0
+        self.scanned = 0
+        self.finished = False
+        self._pacer = Pacer(PURGE_OLD_INTERVAL)
+        self._last_report = time.monotonic()
+
+    def _keep(self, message: discord.Message) -> bool:
+        return message.pinned or (self.progress is not None and message.id == self.progress.id)
+
+    async def run(self) -> int:
+        cutoff = discord.utils.utcnow() - BULK_MAX_AGE
+        batch: List[discord.Message] = []
+        async for message in self.channel.history(limit=None, oldest_first=False):
+            self.scanned += 1
+            if self._keep(message):
+                continue
+            if message.created_at > cutoff:
+                batch.append(message)
+                if len(batch) >= BULK_SIZE:
+                    await self._bulk(batch)
+                    batch = []
+            else:
+                # History is newest first: from here on, everything is too old for bulk deletes
+                if batch:
+                    await self._bulk(batch)
+                    batch = []
+                await self._single(message)
+            await self._report()
+        if batch:
+            await self._bulk(batch)
+        self.finished = True
+        return self.deleted
+
+    async def _bulk(self, batch: List[discord.Message]):
+        try:
+            await self.channel.delete_messages(batch, reason="Lycoris: purge")
+            self.deleted += len(batch)
+        except discord.NotFound:
+            # Someone deleted part of the batch meanwhile: fall back to one by one
+            for message in batch:
+                await self._single(message)
+
+    async def _single(self, message: discord.Message):
+        await self._pacer.wait()
+        try:
+            await message.delete()
+            self.deleted += 1
+            self._pacer.ok()
+        except discord.NotFound:
+            pass
+        except discord.HTTPException as error:
+            if error.status != 429:
+                raise
+            self._pacer.throttled(getattr(error, "retry_after", 0.0) or 0.0)
+            await self._single(message)
+
+    async def _report(self):
+        if self.progress is None:
+            return
+        if time.monotonic() - self._last_report < PURGE_PROGRESS_INTERVAL:
+            return
+        self._last_report = time.monotonic()
+        try:
+            await self.progress.edit(content=f"Nettoyage en cours... {self.deleted} messages supprimés")
+        except discord.HTTPException as error:
+            logging.info(f"Lycoris::Purge::Can't update progress in {self.channel}: {error}")
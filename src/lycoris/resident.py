@@ -0,0 +1,226 @@
+import os
+import re
+import sys
+import struct
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from .config import RESIDENT_BUDGET_MB, SPILL_DIR
+from . import metrics, state
+
+# Rough RAM cost of one history entry (its dict) and of one fact (its BM25 postings), on top of the text
+ENTRY_OVERHEAD = 240
+FACT_OVERHEAD = 320
+# Evictions go down to this share of the budget, so one burst doesn't trigger one spill per message
+LOW_WATER = 0.9
+
+def record_bytes(record: state.InstanceRecord) -> int:
+    """Estimated RAM held by an instance's history and facts"""
+    return (sum(sys.getsizeof(entry["content"]) + ENTRY_OVERHEAD for entry in record.history)
+            + sum(sys.getsizeof(fact) + FACT_OVERHEAD for fact in record.facts))
+
+# --- Spill files: one per channel, a sequence of (kind, length) headers followed by UTF-8 text
+_HEADER = struct.Struct(">cI")
+_ENTRY, _FACT = b"h", b"f"
+
+def encode(history, known_facts) -> bytes:
+    parts = []
+    for entry in history:
+        data = f"{entry['role']}\0{entry['content']}".encode()
+        parts += (_HEADER.pack(_ENTRY, len(data)), data)
+    for fact in known_facts:
+        data = fact.encode()
+        parts += (_HEADER.pack(_FACT, len(data)), data)
+    return b"".join(parts)
+
+def decode(blob: bytes) -> Tuple[List[Dict[str, str]], List[str]]:
+    history, known_facts = [], []
+    view = memoryview(blob)
+    offset = 0
+    while offset < len(blob):
+        kind, length = _HEADER.unpack_from(blob, offset)
+        offset += _HEADER.size
+        text = str(view[offset:offset + length], "utf-8")
+        offset += length
+        if kind == _ENTRY:
+            role, _, content = text.partition("\0")
+            history.append({"role": role, "content": content})
+        elif kind == _FACT:
+            known_facts.append(text)
+    return history, known_facts
+
+# Spill file names: <prefix><channel id>.bin, and .bin.tmp while being written
+SPILL_PREFIX = "lyc-spill-"
+SPILL_FILE = re.compile(rf"{re.escape(SPILL_PREFIX)}\d+\.bin(\.tmp)?")
+
+class SpillStore:
+    """Where evicted memory goes when there is no state store (STATE_DB is empty).
+
+    It plays the store's part for lycoris.state: changes mark their channel, drop() deletes
+    the file and load_channel() reads it back. Files only live as long as the process, and
+    only files named like its own (SPILL_PREFIX) are ever deleted from the directory.
+    """
+
+    def __init__(self, directory: str = SPILL_DIR):
+        self.directory = directory
+        self._dirty: Set[int] = set()
+        self._created = False   # the directory didn't exist: removed on close once empty
+
+    def _path(self, channel_id: int) -> str:
+        return os.path.join(self.directory, f"{SPILL_PREFIX}{channel_id}.bin")
+
+    async def start(self):
+        await asyncio.to_thread(self._reset)
+        state.attach_store(self)
+
+    async def close(self):
+        state.attach_store(None)
+        await asyncio.to_thread(self._cleanup)
+
+    def _reset(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+            self._created = True
+        # Leftovers of a run that didn't close
+        self._cleanup(keep_directory=True)
+
+    def _cleanup(self, keep_directory: bool = False):
+        for name in os.listdir(self.directory):
+            if SPILL_FILE.fullmatch(name):
+                os.remove(os.path.join(self.directory, name))
+        if self._created and not keep_directory:
+            try:
+                os.rmdir(self.directory)
+            except OSError:
+                pass
+
+    # --- Store interface (see lycoris.state)
+    def mark(self, channel_id: int):
+        self._dirty.add(channel_id)
+
+    def drop(self, channel_id: int):
+        self._dirty.discard(channel_id)
+        try:
+            os.remove(self._path(channel_id))
+        except FileNotFoundError:
+            pass
+
+    def pending(self, channel_id: int) -> bool:
+        return channel_id in self._dirty
+
+    async def load_channel(self, channel_id: int) -> Tuple[List[Dict[str, str]], List[str]]:
+        try:
+            blob = await asyncio.to_thread(self._read, channel_id)
+        except FileNotFoundError:
+            return [], []
+        return decode(blob)
+
+    async def spill(self, records: List[state.InstanceRecord]):
+        # Snapshot on the event loop; a change made while writing marks the channel again
+        batch = []
+        for record in records:
+            if record.channel_id in self._dirty or not os.path.exists(self._path(record.channel_id)):
+                self._dirty.discard(record.channel_id)
+                batch.append((record.channel_id, encode(record.history, record.facts)))
+        if batch:
+            await asyncio.to_thread(self._write, batch)
+
+    def _read(self, channel_id: int) -> bytes:
+        with open(self._path(channel_id), "rb") as file:
+            return file.read()
+
+    def _write(self, batch: List[Tuple[int, bytes]]):
+        for channel_id, blob in batch:
+            path = self._path(channel_id)
+            with open(path + ".tmp", "wb") as file:
+                file.write(blob)
+            os.replace(path + ".tmp", path)
+
+class ResidentSet:
+    """Keeps instance memory within a RAM budget.
+
+    note() is called whenever an instance is used: it re-measures the instance and moves it
+    to the most recent end. Once the total goes over budget, a background task hands the
+    least recently used instances to the store and releases their history and facts
+    (state.unload); the next message reloads them through state.ensure_loaded().
+    """
+
+    def __init__(self, budget_mb: float = RESIDENT_BUDGET_MB):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self._sizes: "OrderedDict[int, int]" = OrderedDict()   # channel.id -> bytes, oldest first
+        self.resident_bytes = 0
+        self.evictions = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def note(self, channel_id: int):
+        if self.budget <= 0:
+            return
+        record = state.registry.get(channel_id)
+        if record is None or not record.loaded:
+            return
+        size = record_bytes(record)
+        self.resident_bytes += size - self._sizes.pop(channel_id, 0)
+        self._sizes[channel_id] = size
+        if self.resident_bytes > self.budget and self._task is None:
+            self._task = asyncio.create_task(self._enforce())
+
+    def forget(self, channel_id: int):
+        self.resident_bytes -= self._sizes.pop(channel_id, 0)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "resident": len(self._sizes),
+            "resident_bytes": self.resident_bytes,
+            "budget_bytes": self.budget,
+            "evictions": self.evictions,
+        }
+
+    async def _enforce(self):
+        try:
+            while self.resident_bytes > self.budget * LOW_WATER and state.attached_store() is not None:
+                excess = self.resident_bytes - self.budget * LOW_WATER
+                victims = []
+                for channel_id in list(self._sizes)[:-1]:   # never the instance that just spoke
+                    if excess <= 0:
+                        break
+                    record = state.registry.get(channel_id)
+                    if record is None or not record.loaded:
+                        self.forget(channel_id)
+                        continue
+                    victims.append(record)
+                    excess -= self._sizes[channel_id]
+                if not victims:
+                    return
+                store = state.attached_store()
+                await store.spill(victims)
+                released = 0
+                for record in victims:
+                    channel_id = record.channel_id
+                    # Skip the ones that spoke again (or were closed) while the store was writing
+                    if (state.registry.get(channel_id) is not record or not record.loaded
+                            or store.pending(channel_id)):
+                        continue
+                    state.unload(record)
+                    self.forget(channel_id)
+                    released += 1
+                self.evictions += released
+                logging.info(f"Lycoris::Resident::{released} instances evicted, "
+                             f"{self.resident_bytes / 1048576:.1f}/{self.budget / 1048576:.0f} MiB resident")
+                if not released:
+                    return
+        except Exception as error:
+            logging.error(f"Lycoris::Resident::Eviction failed: {error!r}")
+        finally:
+            self._task = None
+
+residents = ResidentSet()
+state.forget_hooks.append(residents.forget)
+
+metrics.Gauge("lycoris_resident_bytes", "Estimated RAM held by instance histories and facts",
+              lambda: [((), residents.resident_bytes)])
+metrics.Gauge("lycoris_resident_instances", "Instances whose memory is in RAM",
+              lambda: [((), len(residents))])
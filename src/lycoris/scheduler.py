@@ -0,0 +1,204 @@
+import heapq
+import asyncio
+import logging
+import itertools
+import discord
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Sequence, Tuple
+from .config import LLM_COALESCE_DELAY
+
+# A request's place in the fair-queue hierarchy, outermost first: [(key, weight), ...]
+Flow = Sequence[Tuple[Hashable, float]]
+DEFAULT_FLOW: Flow = ((("default",), 1.0),)
+# Past this many children, a node forgets the idle ones whose finish tag virtual time has passed
+PRUNE_AT = 4096
+
+def flows_for(message: discord.Message) -> List[Tuple[Hashable, float]]:
+    """Fair-queue path of a message: its guild, then its author within the guild"""
+    user = (("user", message.author.id), 1.0)
+    if message.guild:
+        return [(("guild", message.guild.id), 1.0), user]
+    return [user]
+
+class _Node:
+    """One level of the hierarchy: its children's finish tags and the backlogged ones by start tag"""
+    __slots__ = ("vtime", "finish", "children", "heap", "waiters")
+
+    def __init__(self):
+        self.vtime = 0.0
+        self.finish: Dict[Hashable, float] = {}
+        self.children: Dict[Hashable, "_Node"] = {}
+        self.heap: List[Tuple[float, int, Hashable, float]] = []   # (start tag, seq, key, weight)
+        self.waiters: Deque[Tuple[asyncio.Future, float]] = deque()  # at the end of a path
+
+    def backlogged(self) -> bool:
+        return bool(self.waiters or self.heap)
+
+class FairQueue:
+    """Hierarchical weighted fair admission to a fixed number of slots (start-time fair queuing
+    at every level).
+
+    A request follows a path of flows, e.g. guild then user. Each node shares the slots
+    between its backlogged children by start tag, so guilds get even turns with each other,
+    and users get even turns within their guild: one chatty user only delays the others of
+    its guild by one request, and a busy guild only delays other guilds by one request.
+    A flow's weight scales its share against its siblings (1 everywhere by default).
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.busy = 0
+        self._root = _Node()
+        self._seq = itertools.count()
+        self._waiting = 0
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @staticmethod
+    def _prune(node: _Node):
+        if len(node.children) <= PRUNE_AT:
+            return
+        for key in [key for key, child in node.children.items()
+                    if not child.backlogged() and node.finish.get(key, 0.0) <= node.vtime]:
+            del node.children[key]
+            node.finish.pop(key, None)
+
+    def _charge(self, path: Flow, cost: float):
+        """A request admitted without queuing still moves the finish tags along its path"""
+        node = self._root
+        for key, weight in path:
+            start = max(node.vtime, node.finish.get(key, 0.0))
+            node.vtime = start
+            node.finish[key] = start + cost / max(weight, 1e-6)
+            child = node.children.get(key)
+            if child is None:
+                child = node.children[key] = _Node()
+                self._prune(node)
+            node = child
+
+    def _enqueue(self, path: Flow, fut: asyncio.Future, cost: float):
+        node = self._root
+        for key, weight in path:
+            child = node.children.get(key)
+            if child is None:
+                child = node.children[key] = _Node()
+                self._prune(node)
+            if not child.backlogged():
+                start = max(node.vtime, node.finish.get(key, 0.0))
+                heapq.heappush(node.heap, (start, next(self._seq), key, weight))
+            node = child
+        node.waiters.append((fut, cost))
+
+    def _pop(self, node: _Node) -> Optional[Tuple[asyncio.Future, float]]:
+        """Next live waiter under `node`; waiters that gave up are dropped on the way"""
+        while node.waiters:
+            fut, cost = node.waiters.popleft()
+            if not fut.done():
+                return fut, cost
+        while node.heap:
+            start, _, key, weight = heapq.heappop(node.heap)
+            child = node.children[key]
+            picked = self._pop(child)
+            if picked is None:
+                continue
+            node.vtime = max(node.vtime, start)
+            finish = node.finish[key] = start + picked[1] / max(weight, 1e-6)
+            if child.backlogged():
+                heapq.heappush(node.heap, (finish, next(self._seq), key, weight))
+            return picked
+        return None
+
+    async def acquire(self, flows: Flow = (), cost: float = 1.0, timeout: Optional[float] = None):
+        path = flows or DEFAULT_FLOW
+        if self.busy < self.capacity and not self._waiting:
+            self.busy += 1
+            self._charge(path, cost)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._enqueue(path, fut, cost)
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except BaseException:
+            if fut.done() and not fut.cancelled():
+                # The slot was granted just as we gave up: hand it to the next waiter
+                self.release()
+            else:
+                fut.cancel()
+                self._waiting -= 1
+            raise
+
+    def release(self):
+        self.busy -= 1
+        while self.busy < self.capacity:
+            picked = self._pop(self._root)
+            if picked is None:
+                break
+            self.busy += 1
+            self._waiting -= 1
+            picked[0].set_result(None)
+
+class _ChannelTurns:
+    __slots__ = ("pending", "task", "commit")
+
+    def __init__(self):
+        self.pending: List[str] = []
+        self.task: Optional[asyncio.Task] = None
+        self.commit: Optional[asyncio.Task] = None
+
+class ChannelScheduler:
+    """Keep one generation per channel: merge bursts into one turn and cancel stale ones.
+
+    `generate(turn)` may be cancelled when a newer message arrives; its messages stay
+    pending and are merged into the next turn. `deliver(turn, result)` is never cancelled.
+    """
+
+    def __init__(self, coalesce_delay: float = LLM_COALESCE_DELAY):
+        self.coalesce_delay = coalesce_delay
+        self._channels: Dict[int, _ChannelTurns] = {}
+
+    def busy(self, channel_id: int) -> bool:
+        return channel_id in self._channels
+
+    def submit(self, channel_id: int, text: str,
+               generate: Callable[[str], Awaitable], deliver: Callable[[str, object], Awaitable]):
+        turns = self._channels.setdefault(channel_id, _ChannelTurns())
+        turns.pending.append(text)
+        previous = turns.task
+        if previous and not previous.done() and previous is not turns.commit:
+            previous.cancel()
+        turns.task = asyncio.create_task(self._run(channel_id, turns, previous, generate, deliver))
+
+    def cancel(self, channel_id: int):
+        """Drop everything queued or running for a channel"""
+        turns = self._channels.pop(channel_id, None)
+        if turns and turns.task and turns.task is not turns.commit:
+            turns.task.cancel()
+
+    async def _run(self, channel_id: int, turns: _ChannelTurns, previous: Optional[asyncio.Task],
+                   generate: Callable[[str], Awaitable], deliver: Callable[[str, object], Awaitable]):
+        waits = {task for task in (previous, turns.commit) if task is not None}
+        if waits:
+            await asyncio.wait(waits)
+        await asyncio.sleep(self.coalesce_delay)
+
+        count = len(turns.pending)
+        turn = "\n".join(turns.pending)
+        try:
+            result = await generate(turn)
+            turns.commit = asyncio.current_task()
+            await deliver(turn, result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logging.error(f"Lycoris::Scheduler::Turn failed in {channel_id}: {error}")
+            if turns.commit is not asyncio.current_task():
+                del turns.pending[:count]
+        finally:
+            if turns.commit is asyncio.current_task():
+                turns.commit = None
+                del turns.pending[:count]
+            if turns.task is asyncio.current_task() and self._channels.get(channel_id) is turns:
+                del self._channels[channel_id]
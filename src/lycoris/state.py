@@ -1,16 +1,305 @@
-from collections import defaultdict, deque
-from typing import Dict, List
+from collections import deque
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
 from .config import HISTO_MAX, DEFAULT_SYSTEM
+from .facts_index import FactsIndex
 
-# --- Memory per instance
-memory: Dict[int, deque]   = defaultdict(lambda: deque(maxlen=HISTO_MAX))
-facts: Dict[int, List[str]] = defaultdict(list)
-personas: Dict[int, str]    = defaultdict(lambda: DEFAULT_SYSTEM)
+# --- Persistence hook (see lycoris.store): changed channels are flushed in the background
+_store = None
 
-# --- Instance map
-user_instances: Dict[int, List[int]] = defaultdict(list)  # user.id -> [channel.id...]
-instance_owner: Dict[int, int]       = {}                 # channel.id -> user.id
-instance_tags: Dict[int, List[str]]  = defaultdict(list)  # channel.id -> ["joyeuse", ...]
+# --- Called with channel.id when an instance is forgotten, so derived caches can follow
+forget_hooks: List[Callable[[int], None]] = []
+
+# --- Called with channel.id when an instance's memory is evicted from RAM (see lycoris.resident)
+unload_hooks: List[Callable[[int], None]] = []
+
+def attach_store(store):
+    global _store
+    _store = store
+
+def attached_store():
+    return _store
+
+def touch(channel_id: int):
+    if _store is not None:
+        _store.mark(channel_id)
+
+class History(deque):
+    """Instance conversation history; every change marks its channel dirty"""
+
+    def __init__(self, channel_id: int, items=()):
+        super().__init__(items, maxlen=HISTO_MAX)
+        self.channel_id = channel_id
+
+    def append(self, item):
+        super().append(item)
+        touch(self.channel_id)
+
+    def appendleft(self, item):
+        super().appendleft(item)
+        touch(self.channel_id)
+
+    def extend(self, items):
+        super().extend(items)
+        touch(self.channel_id)
+
+    def extendleft(self, items):
+        super().extendleft(items)
+        touch(self.channel_id)
+
+    def insert(self, index: int, item):
+        super().insert(index, item)
+        touch(self.channel_id)
+
+    def pop(self):
+        item = super().pop()
+        touch(self.channel_id)
+        return item
+
+    def popleft(self):
+        item = super().popleft()
+        touch(self.channel_id)
+        return item
+
+    def remove(self, item):
+        super().remove(item)
+        touch(self.channel_id)
+
+    def rotate(self, n: int = 1):
+        super().rotate(n)
+        touch(self.channel_id)
+
+    def reverse(self):
+        super().reverse()
+        touch(self.channel_id)
+
+    def clear(self):
+        super().clear()
+        touch(self.channel_id)
+
+    def __setitem__(self, index, item):
+        super().__setitem__(index, item)
+        touch(self.channel_id)
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        touch(self.channel_id)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+class Facts(list):
+    """Instance facts, with their BM25 index kept in sync; every change marks its channel dirty"""
+
+    def __init__(self, channel_id: int, items=()):
+        super().__init__(items)
+        self.channel_id = channel_id
+        self.index = FactsIndex(self)
+
+    def _reindex(self):
+        """Order or content changed in place: rebuild the index (recency follows list order)"""
+        self.index = FactsIndex(self)
+        touch(self.channel_id)
+
+    def append(self, item):
+        super().append(item)
+        self.index.add(item)
+        touch(self.channel_id)
+
+    def extend(self, items):
+        items = list(items)
+        super().extend(items)
+        for item in items:
+            self.index.add(item)
+        touch(self.channel_id)
+
+    def insert(self, index: int, item):
+        super().insert(index, item)
+        self._reindex()
+
+    def remove(self, item):
+        super().remove(item)
+        self.index.remove(item)
+        touch(self.channel_id)
+
+    def pop(self, index: int = -1):
+        item = super().pop(index)
+        self.index.remove(item)
+        touch(self.channel_id)
+        return item
+
+    def clear(self):
+        super().clear()
+        self.index.clear()
+        touch(self.channel_id)
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._reindex()
+
+    def reverse(self):
+        super().reverse()
+        self._reindex()
+
+    def __setitem__(self, index, item):
+        super().__setitem__(index, item)
+        self._reindex()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._reindex()
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def __imul__(self, count: int):
+        super().__imul__(count)
+        self._reindex()
+        return self
+
+class InstanceRecord:
+    """Everything Lycoris keeps about one private instance"""
+    __slots__ = ("channel_id", "guild_id", "owner_id", "persona", "tags", "summary", "history", "facts", "loaded")
+
+    def __init__(self, channel_id: int, guild_id: int, owner_id: int, persona: Optional[str] = None,
+                 tags: Iterable[str] = (), summary: str = "", loaded: bool = True):
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.owner_id = owner_id
+        self.persona = persona or DEFAULT_SYSTEM
+        self.tags: List[str] = list(tags)
+        # Older turns folded into a few sentences (see lycoris.compaction)
+        self.summary = summary
+        self.history = History(channel_id)
+        self.facts = Facts(channel_id)
+        # History and facts are in RAM (new instance, or read back from the store)
+        self.loaded = loaded
+
+    def __repr__(self) -> str:
+        return f"InstanceRecord(channel={self.channel_id}, guild={self.guild_id}, owner={self.owner_id})"
+
+class InstanceRegistry:
+    """Every instance, indexed by channel, by (guild, owner) and by guild.
+
+    Records are only created by create()/restore() and dropped by remove(), which
+    keep all three indexes in step; lookups never allocate.
+    """
+
+    def __init__(self):
+        self._channels: Dict[int, InstanceRecord] = {}
+        self._members: Dict[Tuple[int, int], Set[int]] = {}   # (guild.id, user.id) -> {channel.id}
+        self._guilds: Dict[int, Set[int]] = {}                # guild.id -> {channel.id}
+
+    def __contains__(self, channel_id: int) -> bool:
+        return channel_id in self._channels
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def __iter__(self) -> Iterator[InstanceRecord]:
+        return iter(list(self._channels.values()))
+
+    def get(self, channel_id: int) -> Optional[InstanceRecord]:
+        return self._channels.get(channel_id)
+
+    def owner(self, channel_id: int) -> Optional[int]:
+        record = self._channels.get(channel_id)
+        return record.owner_id if record else None
+
+    # --- Per guild
+    def channels_of(self, guild_id: int, user_id: int) -> FrozenSet[int]:
+        return frozenset(self._members.get((guild_id, user_id), ()))
+
+    def count_for(self, guild_id: int, user_id: int) -> int:
+        return len(self._members.get((guild_id, user_id), ()))
+
+    def guild_channels(self, guild_id: int) -> FrozenSet[int]:
+        return frozenset(self._guilds.get(guild_id, ()))
+
+    def guild_count(self, guild_id: int) -> int:
+        return len(self._guilds.get(guild_id, ()))
+
+    # --- Changes
+    def create(self, channel_id: int, guild_id: int, owner_id: int, persona: Optional[str] = None,
+               tags: Iterable[str] = ()) -> InstanceRecord:
+        """Register a new (or rediscovered) instance with empty memory"""
+        record = self._add(InstanceRecord(channel_id, guild_id, owner_id, persona, tags))
+        touch(channel_id)
+        return record
+
+    def restore(self, channel_id: int, guild_id: int, owner_id: int, persona: Optional[str],
+                tags: Iterable[str], summary: str = "") -> InstanceRecord:
+        """Register an instance read back from the store; its history is loaded on first use"""
+        return self._add(InstanceRecord(channel_id, guild_id, owner_id, persona, tags, summary or "", loaded=False))
+
+    def set_tags(self, channel_id: int, tags: Iterable[str]):
+        self._channels[channel_id].tags = list(tags)
+        touch(channel_id)
+
+    def set_persona(self, channel_id: int, persona: Optional[str]):
+        self._channels[channel_id].persona = persona or DEFAULT_SYSTEM
+        touch(channel_id)
+
+    def set_summary(self, channel_id: int, summary: str):
+        self._channels[channel_id].summary = summary
+        touch(channel_id)
+
+    def remove(self, channel_id: int) -> Optional[InstanceRecord]:
+        """Drop every trace of an instance, in RAM and in the store"""
+        record = self._unindex(channel_id)
+        if record is None:
+            return None
+        if _store is not None:
+            _store.drop(channel_id)
+        for hook in forget_hooks:
+            hook(channel_id)
+        return record
+
+    def _add(self, record: InstanceRecord) -> InstanceRecord:
+        self._unindex(record.channel_id)
+        self._channels[record.channel_id] = record
+        self._members.setdefault((record.guild_id, record.owner_id), set()).add(record.channel_id)
+        self._guilds.setdefault(record.guild_id, set()).add(record.channel_id)
+        return record
+
+    def _unindex(self, channel_id: int) -> Optional[InstanceRecord]:
+        record = self._channels.pop(channel_id, None)
+        if record is None:
+            return None
+        for index, key in ((self._members, (record.guild_id, record.owner_id)), (self._guilds, record.guild_id)):
+            channels = index.get(key)
+            if channels is not None:
+                channels.discard(channel_id)
+                if not channels:
+                    del index[key]
+        return record
+
+registry = InstanceRegistry()
+
+def unload(record: InstanceRecord):
+    """Release a record's history and facts; ensure_loaded() reads them back from the store"""
+    record.history = History(record.channel_id)
+    record.facts = Facts(record.channel_id)
+    record.loaded = False
+    for hook in unload_hooks:
+        hook(record.channel_id)
 
 def is_instance_channel_id(channel_id: int) -> bool:
-    return channel_id in instance_owner
\ No newline at end of file
+    return channel_id in registry
+
+def is_loaded(channel_id: int) -> bool:
+    record = registry.get(channel_id)
+    return record is None or record.loaded
+
+async def ensure_loaded(channel_id: int):
+    """Lazily read one channel's history and facts from the store on its first message"""
+    record = registry.get(channel_id)
+    if record is None or record.loaded or _store is None:
+        return
+    history, known_facts = await _store.load_channel(channel_id)
+    if record.loaded or registry.get(channel_id) is not record:
+        return
+    record.history = History(channel_id, history)
+    record.facts = Facts(channel_id, known_facts)
+    record.loaded = True
@@ -0,0 +1,194 @@
+import json
+import asyncio
+import logging
+import sqlite3
+import threading
+import contextlib
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from .config import STATE_DB, STATE_FLUSH_INTERVAL, STATE_FLUSH_BATCH
+from . import state
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id   INTEGER NOT NULL,
+    owner_id   INTEGER NOT NULL,
+    persona    TEXT,
+    tags       TEXT NOT NULL DEFAULT '[]',
+    summary    TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS instances_guild ON instances(guild_id);
+CREATE TABLE IF NOT EXISTS messages (
+    channel_id INTEGER NOT NULL,
+    seq        INTEGER NOT NULL,
+    role       TEXT NOT NULL,
+    content    TEXT NOT NULL,
+    PRIMARY KEY (channel_id, seq)
+);
+CREATE TABLE IF NOT EXISTS facts (
+    channel_id INTEGER NOT NULL,
+    seq        INTEGER NOT NULL,
+    text       TEXT NOT NULL,
+    PRIMARY KEY (channel_id, seq)
+);
+"""
+
+class StateStore:
+    """SQLite (WAL) persistence for lycoris.state with batched write-behind flushes.
+
+    Changes only mark their channel dirty; a background task snapshots dirty channels
+    on the event loop and writes them in one transaction from a worker thread.
+    In cluster mode every worker opens the same file and only restores (and therefore
+    only ever writes) the instances of the guilds `owns` accepts.
+    """
+
+    def __init__(self, path: str = STATE_DB, flush_interval: float = STATE_FLUSH_INTERVAL,
+                 flush_batch: int = STATE_FLUSH_BATCH, owns: Optional[Callable[[int], bool]] = None):
+        self.path = path
+        self.owns = owns
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._dirty: Set[int] = set()
+        self._dropped: Set[int] = set()
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Lifecycle
+    async def start(self) -> int:
+        """Open the database, restore every known instance and start flushing"""
+        await asyncio.to_thread(self._open)
+        rows = await asyncio.to_thread(self._read_instances)
+        if self.owns is not None:
+            rows = [row for row in rows if self.owns(row[1])]
+        for channel_id, guild_id, owner_id, persona, tags, summary in rows:
+            state.registry.restore(channel_id, guild_id, owner_id, persona, json.loads(tags), summary)
+        state.attach_store(self)
+        self._task = asyncio.create_task(self._flush_loop())
+        logging.info(f"Lycoris::Store::{len(rows)} instances loaded from {self.path}")
+        return len(rows)
+
+    async def close(self):
+        if self._task:
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        state.attach_store(None)
+        if self._db is not None:
+            await asyncio.to_thread(self._db.close)
+            self._db = None
+
+    # --- Change tracking (called from lycoris.state)
+    def mark(self, channel_id: int):
+        self._dirty.add(channel_id)
+        if len(self._dirty) >= self.flush_batch:
+            self._wake.set()
+
+    def drop(self, channel_id: int):
+        self._dirty.discard(channel_id)
+        self._dropped.add(channel_id)
+        self._wake.set()
+
+    def pending(self, channel_id: int) -> bool:
+        """Changes of this channel not written yet"""
+        return channel_id in self._dirty
+
+    async def spill(self, records: List[state.InstanceRecord]):
+        """Make sure the store holds everything of `records` before their memory is released"""
+        if any(record.channel_id in self._dirty for record in records):
+            await self.flush()
+
+    # --- Reads
+    async def load_channel(self, channel_id: int) -> Tuple[List[Dict[str, str]], List[str]]:
+        return await asyncio.to_thread(self._read_channel, channel_id)
+
+    # --- Flushing
+    async def flush(self):
+        if not (self._dirty or self._dropped) or self._db is None:
+            return
+        dirty, self._dirty = self._dirty, set()
+        dropped, self._dropped = self._dropped, set()
+        batch = [self._snapshot(state.registry.get(channel_id)) for channel_id in dirty if channel_id in state.registry]
+        try:
+            await asyncio.to_thread(self._write, batch, dropped)
+        except Exception as error:
+            logging.error(f"Lycoris::Store::Flush failed, will retry: {error}")
+            self._dirty |= dirty
+            self._dropped |= dropped
+
+    async def _flush_loop(self):
+        while not self._closing:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            self._wake.clear()
+            await self.flush()
+
+    def _snapshot(self, record: state.InstanceRecord):
+        row = (record.channel_id, record.guild_id, record.owner_id, record.persona, json.dumps(record.tags),
+               record.summary)
+        if not record.loaded:
+            # History was never read back: keep what is on disk
+            return row, None, None
+        history = [(m["role"], m["content"]) for m in record.history]
+        return row, history, list(record.facts)
+
+    # --- Worker thread side
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # Cluster workers share the file: wait for another writer instead of failing
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(instances)")}
+        if "summary" not in columns:
+            # Databases from before rolling summaries
+            self._db.execute("ALTER TABLE instances ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+
+    def _read_instances(self):
+        with self._db_lock:
+            return self._db.execute("SELECT channel_id, guild_id, owner_id, persona, tags, summary FROM instances").fetchall()
+
+    def _read_channel(self, channel_id: int):
+        with self._db_lock:
+            history = self._db.execute(
+                "SELECT role, content FROM messages WHERE channel_id = ? ORDER BY seq", (channel_id,)
+            ).fetchall()
+            known_facts = self._db.execute(
+                "SELECT text FROM facts WHERE channel_id = ? ORDER BY seq", (channel_id,)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in history], [text for (text,) in known_facts]
+
+    def _write(self, batch, dropped: Set[int]):
+        with self._db_lock:
+            db = self._db
+            db.execute("BEGIN")
+            try:
+                for channel_id in dropped:
+                    db.execute("DELETE FROM instances WHERE channel_id = ?", (channel_id,))
+                    db.execute("DELETE FROM messages WHERE channel_id = ?", (channel_id,))
+                    db.execute("DELETE FROM facts WHERE channel_id = ?", (channel_id,))
+                for row, history, known_facts in batch:
+                    db.execute("INSERT OR REPLACE INTO instances (channel_id, guild_id, owner_id, persona, tags, summary) "
+                               "VALUES (?, ?, ?, ?, ?, ?)", row)
+                    if history is None:
+                        continue
+                    channel_id = row[0]
+                    db.execute("DELETE FROM messages WHERE channel_id = ?", (channel_id,))
+                    db.executemany(
+                        "INSERT INTO messages VALUES (?, ?, ?, ?)",
+                        [(channel_id, seq, role, content) for seq, (role, content) in enumerate(history)],
+                    )
+                    db.execute("DELETE FROM facts WHERE channel_id = ?", (channel_id,))
+                    db.executemany(
+                        "INSERT INTO facts VALUES (?, ?, ?)",
+                        [(channel_id, seq, text) for seq, text in enumerate(known_facts)],
+                    )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
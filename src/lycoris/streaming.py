@@ -0,0 +1,96 @@
+import time
+import asyncio
+import contextlib
+import discord
+from typing import List, Optional, AsyncIterator
+from .config import STREAM_EDIT_INTERVAL
+from .llm import EMPTY_REPLY, describe_error
+from .utils import next_chunk
+
+class StreamingMessage:
+    """Discord message that grows in place as tokens arrive, rolling over at the size limit"""
+
+    def __init__(self, channel: discord.abc.Messageable, interval: float = STREAM_EDIT_INTERVAL, maxlen: int = 1990):
+        self.channel = channel
+        self.interval = interval
+        self.maxlen = maxlen
+        self.text = ""
+        self.messages: List[discord.Message] = []
+        self._offset = 0
+        self._fence = ""   # code fence reopened at the top of the current message
+        self._current: Optional[discord.Message] = None
+        self._shown = ""
+        self._last_edit = 0.0
+
+    async def push(self, delta: str):
+        self.text += delta
+        if self._current is None and not self.messages:
+            # First message goes out as soon as there is something to show
+            if self.text.strip():
+                await self._sync()
+            return
+        if len(self.text) - self._offset > self.maxlen - len(self._fence) - 1 or time.monotonic() - self._last_edit >= self.interval:
+            await self._sync()
+
+    async def finish(self) -> str:
+        await self._sync()
+        if not self.messages:
+            await self._show(EMPTY_REPLY)
+        return self.text.strip() or EMPTY_REPLY
+
+    async def fail(self, error: Exception) -> str:
+        """Append the user-facing error text and finish"""
+        await self.push(("\n\n" if self.text.strip() else "") + describe_error(error))
+        return await self.finish()
+
+    async def discard(self):
+        """Delete what was already posted (the generation became obsolete)"""
+        for message in self.messages:
+            with contextlib.suppress(discord.HTTPException):
+                await message.delete()
+        self.messages.clear()
+        self._current = None
+
+    async def consume(self, deltas: AsyncIterator[str]):
+        """Push every delta of a stream; posted messages are deleted if cancelled"""
+        try:
+            async for delta in deltas:
+                await self.push(delta)
+        except asyncio.CancelledError:
+            await self.discard()
+            raise
+
+    async def _sync(self):
+        while True:
+            content, used, fence = next_chunk(self.text[self._offset:], self.maxlen, self._fence)
+            if self._offset + used >= len(self.text):
+                break
+            # Full message: freeze it on a clean boundary and continue in a new one
+            await self._show(content)
+            self._offset += used
+            self._fence = fence
+            self._current = None
+            self._shown = ""
+        await self._show(content)
+
+    async def _show(self, content: str):
+        content = content.strip()
+        if not content or content == self._shown:
+            return
+        if self._current is None:
+            self._current = await self.channel.send(content)
+            self.messages.append(self._current)
+        else:
+            await self._current.edit(content=content)
+        self._shown = content
+        self._last_edit = time.monotonic()
+
+async def stream_reply(channel: discord.abc.Messageable, deltas: AsyncIterator[str]) -> str:
+    """Stream an Ollama answer (OllamaClient.stream or stream_generate) into the channel and return the full text"""
+    out = StreamingMessage(channel)
+    try:
+        async with channel.typing():
+            await out.consume(deltas)
+    except Exception as error:
+        return await out.fail(error)
+    return await out.finish()
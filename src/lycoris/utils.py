@@ -1,10 +1,99 @@
-from typing import List
+import re
+import time
+import asyncio
+import unicodedata
+from typing import List, Tuple
 import discord
 from .config import GENERAL_CHANNEL_ID
 
+# A fence line: ``` alone, or followed by a short language word. "```x = 1```" is inline code, not a fence
+FENCE_RE = re.compile(r"^[ \t]*```([\w+#-]{0,20})[ \t]*$", re.M)
+FENCE_CLOSE = "\n```"
+SENTENCE_ENDS = (". ", "! ", "? ", "… ", ".\n", "!\n", "?\n")
+
+def open_fence(text: str, fence: str = "") -> str:
+    """Code fence line still open at the end of `text` ("" if balanced), given the one open at its start.
+    Inside a block only a bare ``` closes it; "```python" there is code."""
+    for match in FENCE_RE.finditer(text):
+        if not fence:
+            fence = "```" + match.group(1)
+        elif not match.group(1):
+            fence = ""
+    return fence
+
+def cut_index(text: str, limit: int) -> int:
+    """Where to end a chunk of at most `limit` chars: after a paragraph, a line, a sentence
+    or a word, and only as a last resort between two characters"""
+    if len(text) <= limit:
+        return len(text)
+    window = text[:limit]
+    floor = max(limit // 2, 1)   # don't trade a clean cut for a tiny chunk
+    for separator in ("\n\n", "\n"):
+        index = window.rfind(separator)
+        if index >= floor:
+            return index + len(separator)
+    index = max(window.rfind(end) for end in SENTENCE_ENDS)
+    if index >= floor:
+        return index + 1
+    index = window.rfind(" ")
+    if index >= floor:
+        return index + 1
+    index = limit
+    # Keep accents with their letter and joined emoji together
+    while index > 1 and (unicodedata.combining(text[index]) or "\u200d" in (text[index], text[index - 1])):
+        index -= 1
+    return index
+
+def next_chunk(text: str, maxlen: int = 1990, fence: str = "") -> Tuple[str, int, str]:
+    """First Discord-sized chunk of `text` as (content, chars of `text` used, fence left open).
+    A code block cut in two is closed at the end of the chunk and reopened (`fence`) by the next one."""
+    prefix = fence + "\n" if fence else ""
+    if len(prefix) + len(text) <= maxlen:
+        return prefix + text, len(text), open_fence(text, fence)
+    room = max(maxlen - len(prefix), 1)
+    cut = cut_index(text, room)
+    after = open_fence(text[:cut], fence)
+    if after:
+        # Leave room to close the code block
+        cut = cut_index(text, max(room - len(FENCE_CLOSE), 1))
+        after = open_fence(text[:cut], fence)
+    body = text[:cut]
+    content = prefix + body.rstrip()
+    if after:
+        content += FENCE_CLOSE
+    rest = text[cut:]
+    return content, cut + len(rest) - len(rest.lstrip("\n")), after
+
 def split_discord(text: str, maxlen: int = 1990) -> List[str]:
-    """Split long text into Discord-sized chunks"""
-    return [text[index:index + maxlen] for index in range(0, len(text), maxlen)]
+    """Split long text into Discord-sized chunks on markdown boundaries, keeping code fences balanced"""
+    chunks = []
+    fence = ""
+    while text:
+        content, used, fence = next_chunk(text, maxlen, fence)
+        if content.strip():
+            chunks.append(content)
+        text = text[used:]
+    return chunks
+
+class Pacer:
+    """Space out calls to a per-route rate limit, backing off when Discord answers 429"""
+
+    def __init__(self, interval: float):
+        self.base = interval
+        self.interval = interval
+        self._next = 0.0
+
+    async def wait(self):
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._next = time.monotonic() + self.interval
+
+    def throttled(self, retry_after: float = 0.0):
+        self.interval = min(max(self.interval * 2, retry_after), 30.0)
+
+    def ok(self):
+        self.interval = max(self.base, self.interval * 0.9)
 
 def is_general_channel(channel: discord.abc.GuildChannel) -> bool:
     if not isinstance(channel, discord.TextChannel):
@@ -15,4 +104,4 @@ def is_general_channel(channel: discord.abc.GuildChannel) -> bool:
     return name in ("général", "general")
 
 def channel_link(guild_id: int, channel_id: int) -> str:
-    return f"https://discord.com/channels/{guild_id}/{channel_id}"
\ No newline at end of file
+    return f"https://discord.com/channels/{guild_id}/{channel_id}"
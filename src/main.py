@@ -1,26 +1,50 @@
+import time
+import signal
 import asyncio
 import logging
 import discord
 from discord.ext import commands
+from typing import Optional
 
 from lycoris.config import DISCORD_TOKEN, make_intents
-from lycoris.llm import healthcheck_ollama
+from lycoris.config import STATE_DB, METRICS_PORT, CLUSTER_WORKERS, SHARD_COUNT, LLM_WARMUP, LLM_MAX_INFLIGHT
+from lycoris.config import RESIDENT_BUDGET_MB, SPILL_DIR
+from lycoris.llm import OllamaClient
+from lycoris.delivery import Delivery
+from lycoris.compaction import Compactor
+from lycoris import metrics
+from lycoris.store import StateStore
+from lycoris.resident import SpillStore
+from lycoris.cluster import Supervisor, WorkerSpec, report_loop, inflight_share
 from lycoris.logic.general import GeneralLogic
 from lycoris.logic.instance_chat import InstanceChatLogic
+from lycoris.logic.router import Router
 from lycoris.instances import rehydrate_all, rehydrate_guild
+from lycoris.pool import pool
 
 logging.basicConfig(
     level=logging.INFO, 
     format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
 )
 
-def build_bot() -> commands.Bot:
+def build_bot(spec: Optional[WorkerSpec] = None) -> commands.Bot:
     intents = make_intents()
-    bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
-    return bot
+    if spec is None:
+        return commands.Bot(command_prefix="!", intents=intents, help_command=None)
+    return commands.AutoShardedBot(
+        command_prefix="!", intents=intents, help_command=None,
+        shard_ids=spec.shard_ids, shard_count=spec.shard_count,
+    )
 
-async def main():
-    bot = build_bot()
+async def main(spec: Optional[WorkerSpec] = None):
+    bot = build_bot(spec)
+    if spec is None:
+        bot.llm = OllamaClient()
+    else:
+        # Workers share each Ollama node: together they stay within LLM_MAX_INFLIGHT
+        bot.llm = OllamaClient(max_inflight=inflight_share(LLM_MAX_INFLIGHT, CLUSTER_WORKERS, spec.index))
+    bot.delivery = Delivery()
+    bot.compactor = Compactor(bot.llm)
     
     @bot.event
     async def on_ready():
@@ -28,9 +52,14 @@ async def main():
         await bot.change_presence(activity=discord.Activity(
             type=discord.ActivityType.listening, name="@Lycoris"
         ))
-        await healthcheck_ollama()
-        restored = await rehydrate_all(bot)
-        logging.info(f"Lycoris::Main::{restored} instances found")
+        bot.llm.mark_ready()
+        # Health check, model load and rehydration don't depend on each other
+        begin = time.perf_counter()
+        steps = [bot.llm.healthcheck(), rehydrate_all(bot)]
+        if LLM_WARMUP:
+            steps.append(bot.llm.warmup())
+        restored = (await asyncio.gather(*steps))[1]
+        logging.info(f"Lycoris::Main::{restored} instances found, startup pipeline took {time.perf_counter() - begin:.2f}s")
     
     @bot.event
     async def on_guild_available(guild: discord.Guild):
@@ -38,13 +67,61 @@ async def main():
         if count:
             logging.info(f"Lycoris::Main::{guild.name}: +{count} instances found")
 
-    await bot.add_cog(GeneralLogic(bot))
-    await bot.add_cog(InstanceChatLogic(bot))
+    # Ownership comes from the store; rehydration only scans channels it doesn't know
+    store = StateStore(owns=spec and spec.owns_guild) if STATE_DB else None
+    # Without a database, instances evicted from RAM go to spill files
+    if store is None and RESIDENT_BUDGET_MB > 0:
+        store = SpillStore(SPILL_DIR if spec is None else f"{SPILL_DIR}-{spec.index}")
+    if store:
+        await store.start()
+    # One port per worker: METRICS_PORT, METRICS_PORT + 1...
+    metrics_server = await metrics.serve(METRICS_PORT + spec.index if METRICS_PORT and spec else METRICS_PORT)
+    if metrics_server:
+        metrics.instrument_discord(bot.http)
+    reporter = None
+    if spec:
+        reporter = asyncio.create_task(report_loop(spec, bot))
+        # The supervisor stops workers with SIGTERM: unwind so the store gets flushed
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    await bot.llm.open()
+    try:
+        async with bot:
+            general, instances = GeneralLogic(bot), InstanceChatLogic(bot)
+            bot.router = Router(bot, general, instances)
+            await bot.add_cog(general)
+            await bot.add_cog(instances)
+            await bot.add_cog(bot.router)
+            await bot.start(DISCORD_TOKEN)
+    finally:
+        if reporter:
+            reporter.cancel()
+        await bot.compactor.close()
+        await pool.close()
+        await bot.delivery.close()
+        await bot.llm.close()
+        if metrics_server:
+            metrics_server.close()
+        if store:
+            await store.close()
 
-    await bot.start(DISCORD_TOKEN)
+def run_worker(spec: WorkerSpec):
+    """Entry point of a cluster worker process"""
+    logging.getLogger().handlers[0].setFormatter(logging.Formatter(
+        f"%(asctime)s | %(levelname)s | worker-{spec.index} | %(name)s | %(message)s"
+    ))
+    try:
+        asyncio.run(main(spec))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
 
 if __name__ == "__main__":
-    try:
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        pass
\ No newline at end of file
+    if CLUSTER_WORKERS > 1:
+        if LLM_MAX_INFLIGHT < CLUSTER_WORKERS:
+            logging.warning(f"Lycoris::Cluster::LLM_MAX_INFLIGHT={LLM_MAX_INFLIGHT} is below CLUSTER_WORKERS={CLUSTER_WORKERS}: "
+                            f"every worker keeps one slot, so up to {CLUSTER_WORKERS} generations per Ollama node")
+        Supervisor(run_worker, CLUSTER_WORKERS, SHARD_COUNT).run()
+    else:
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
\ No newline at end of file